@@ -1 +1,5 @@
-__all__=['extract']
+__all__=['extract', 'backends', 'cache', 'database', 'manifest', 'watch',
+         'pipeline', 'volume', 'incidence', 'merge', 'batch', 'bench',
+         'gazetteer', 'profiling']
+
+__version__ = '1.1.7'
@@ -0,0 +1,186 @@
+import io
+import codecs
+import shutil
+import tempfile
+import subprocess
+import importlib.util
+
+# --- Pdf text backends ---
+#
+# A backend turns a pdf file into its text. Each one is named so the text
+# cache can tell apart text extracted by different backends, and none of them
+# import anything heavy until there's a pdf to extract from.
+#
+# The text can also be read one page at a time, so reading can stop before the
+# end of the pdf. Every page ends with a form feed, the way pdftotext and
+# pdfminer separate pages, so joining the pages gives back the whole text.
+
+def split_pages(text):
+    """Generate each page of text, including the form feed that ends it."""
+    start = 0
+    while start < len(text):
+        end = text.find('\f', start)+1 or len(text)
+        yield text[start:end]
+        start = end
+
+class Backend:
+    """The interface of a pdf text backend.
+
+    Subclasses set name and implement text() and available(). They may also
+    implement pages() to read a pdf page by page, otherwise the whole text is
+    extracted and then split into pages.
+    """
+    name = ''
+
+    def text(self, path, encoding='utf-8'):
+        """Return the text of the pdf file at path.
+
+        Parameters:
+            path - the path of the pdf file
+            encoding - the encoding of the text (defaults to utf-8)
+        """
+        raise NotImplementedError
+
+    def pages(self, path, encoding='utf-8'):
+        """Generate the text of each page of the pdf file at path.
+
+        Parameters are the same as text(). When the generator is closed
+        before the last page, the rest of the pdf isn't extracted.
+        """
+        yield from split_pages(self.text(path, encoding=encoding))
+
+    def available(self):
+        """Return whether the backend can be used on this system."""
+        raise NotImplementedError
+
+class PdftotextBackend(Backend):
+    """Extract text by running poppler's pdftotext directly.
+
+    This is the same program textract runs for pdfs, without going through
+    textract's dispatch and encoding detection.
+    """
+    name = 'pdftotext'
+
+    # pdftotext's names for the encodings it can write
+    encodings = {'utf-8': 'UTF-8', 'utf8': 'UTF-8', 'latin-1': 'Latin1',
+                 'latin1': 'Latin1', 'ascii': 'ASCII7'}
+
+    def command(self, path, encoding='utf-8'):
+        """Return the pdftotext command that writes the text of path."""
+        enc = self.encodings.get(encoding.lower(), 'UTF-8')
+        return ['pdftotext', '-enc', enc, str(path), '-']
+
+    def text(self, path, encoding='utf-8'):
+        try:
+            process = subprocess.run(self.command(path, encoding),
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE, check=True)
+        except FileNotFoundError:
+            raise RuntimeError('pdftotext was not found; install poppler or '
+                               'choose another backend') from None
+        except subprocess.CalledProcessError as e:
+            message = e.stderr.decode(errors='replace').strip()
+            raise RuntimeError(f'pdftotext failed on {path}: {message}') \
+                from None
+        return process.stdout.decode(encoding)
+
+    def pages(self, path, encoding='utf-8', chunk_size=64*1024):
+        # Warnings go to a temporary file so that a pdf with lots of them
+        # can't fill up a pipe nobody is reading while the pages are read
+        with tempfile.TemporaryFile() as errors:
+            try:
+                process = subprocess.Popen(self.command(path, encoding),
+                                           stdout=subprocess.PIPE,
+                                           stderr=errors)
+            except FileNotFoundError:
+                raise RuntimeError('pdftotext was not found; install poppler '
+                                   'or choose another backend') from None
+
+            decoder = codecs.getincrementaldecoder(encoding)()
+            page = ''
+            try:
+                for chunk in iter(lambda: process.stdout.read(chunk_size), b''):
+                    page += decoder.decode(chunk)
+                    if '\f' not in page:
+                        continue
+                    done = list(split_pages(page))
+                    page = '' if done[-1].endswith('\f') else done.pop()
+                    yield from done
+                page += decoder.decode(b'', final=True)
+                if page:
+                    yield page
+
+            # Stop pdftotext if the pages stopped being read early
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                process.stdout.close()
+                status = process.wait()
+
+            if status != 0:
+                errors.seek(0)
+                message = errors.read().decode(errors='replace').strip()
+                raise RuntimeError(f'pdftotext failed on {path}: {message}')
+
+    def available(self):
+        return shutil.which('pdftotext') is not None
+
+class PdfminerBackend(Backend):
+    """Extract text in this process with pdfminer.six."""
+    name = 'pdfminer'
+
+    def text(self, path, encoding='utf-8'):
+        from pdfminer.high_level import extract_text
+        return extract_text(str(path))
+
+    def pages(self, path, encoding='utf-8'):
+        # This is what pdfminer's extract_text does, taking the text out
+        # after each page
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.converter import TextConverter
+        from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+
+        with open(path, 'rb') as f, io.StringIO() as output:
+            resources = PDFResourceManager()
+            device = TextConverter(resources, output, laparams=LAParams())
+            interpreter = PDFPageInterpreter(resources, device)
+            for page in PDFPage.get_pages(f):
+                interpreter.process_page(page)
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+
+    def available(self):
+        return importlib.util.find_spec('pdfminer') is not None
+
+class TextractBackend(Backend):
+    """Extract text with textract, which runs pdftotext for pdfs."""
+    name = 'textract'
+
+    def text(self, path, encoding='utf-8'):
+        # textract pulls in a long chain of dependencies, so don't import it
+        # until there's a pdf to extract from
+        import textract
+        return textract.process(str(path), encoding=encoding).decode(encoding)
+
+    def available(self):
+        return importlib.util.find_spec('textract') is not None
+
+backends = {backend.name: backend for backend in (PdftotextBackend(),
+                                                  PdfminerBackend(),
+                                                  TextractBackend())}
+
+# The backend used when none is chosen
+default_backend = 'pdftotext'
+
+def get_backend(name=default_backend):
+    """Return the backend called name.
+
+    Raises a Value error if there's no such backend.
+    """
+    try:
+        return backends[name]
+    except KeyError:
+        raise ValueError(f'Unknown pdf backend "{name}"; choose one of: '+
+                         ', '.join(backends)) from None
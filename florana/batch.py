@@ -0,0 +1,179 @@
+import os
+import tempfile
+
+from pathlib import Path
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from . import backends
+from . import extract
+
+# --- Batches of treatments ---
+#
+# extract_many is the entry point for programs that use florana as a library.
+# A treatment can be given as the path of its pdf, as the bytes of a pdf (say,
+# from an upload) or as text that was already extracted, either as bytes or as
+# a str. A str is text if it's wrapped in TreatmentText or has a line break in
+# it (no pdf path does), and a path otherwise. Paths are made absolute before
+# they're handed out, so the workers don't depend on the working directory,
+# which may change (or differ, in worker processes) while the batch is
+# extracted.
+#
+# Every treatment is extracted on its own: one that can't be read or parsed is
+# returned with its error instead of stopping the batch. The compiled patterns,
+# gazetteer and location key are built once per process and only read after
+# that, so any number of threads can extract at the same time.
+
+# Every pdf file starts with this, give or take some junk before it
+pdf_magic = b'%PDF'
+
+def is_pdf(data):
+    """Return whether bytes are a pdf file rather than its text."""
+    return pdf_magic in data[:1024]
+
+class TreatmentText(str):
+    """The text of a treatment, to extract instead of reading a file.
+
+    extract_many takes a str without line breaks to be the path of a pdf, so
+    wrap text in this to make sure it's taken as text.
+    """
+
+def source_text(source, backend=backends.default_backend, encoding='utf-8'):
+    """Return the treatment text of a path, pdf bytes or text.
+
+    Parameters:
+        source - the absolute path of a pdf, the bytes of a pdf or of its
+                 text, or a TreatmentText
+        backend - the name of the pdf text backend (defaults to
+                  backends.default_backend)
+        encoding - the encoding of the text (defaults to utf-8)
+
+    Pdf bytes are written to a temporary file for the backend to read, since
+    not every backend can read a pdf from memory.
+    """
+    if isinstance(source, TreatmentText):
+        return str(source)
+    if not isinstance(source, bytes):
+        return extract.load_treatment(source, encoding=encoding,
+                                      backend=backend)
+    if not is_pdf(source):
+        return source.decode(encoding)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory)/'treatment.pdf'
+        path.write_bytes(source)
+        return extract.load_treatment(path, encoding=encoding,
+                                      backend=backend)
+
+def source_results(source, name, backend=backends.default_backend,
+                   budget=None, excerpt=200, encoding='utf-8'):
+    """Return the results of extract.extract_from for a source.
+
+    Parameters:
+        source - the absolute path of a pdf, the bytes of a pdf or of its
+                 text, or a TreatmentText
+        name - what to call the treatment in error messages
+        backend, encoding - passed on to source_text
+        budget, excerpt - passed on to extract.results_from (default to None
+                          and 200)
+
+    A treatment that can't be read or partitioned has no records, and its
+    error is recorded in the results instead of being raised.
+    """
+    text = None
+    try:
+        text = source_text(source, backend=backend, encoding=encoding)
+        return extract.results_from(text, budget=budget, excerpt=excerpt)
+
+    # Backends raise their own exceptions on broken pdfs (pdfminer's
+    # PDFSyntaxError, textract's ShellError), so anything that goes wrong
+    # with one treatment is kept to that treatment
+    except Exception as e:
+        reason = str(e).splitlines()[-1] if str(e) else type(e).__name__
+        message = f"Couldn't extract {name}: {reason}"
+        if text is None:
+            record = extract.error_record('load', message, '', 0, 0)
+        else:
+            record = extract.error_record('partition', f"Couldn't extract "
+                                          f"{name}: {e}", text, 0, len(text),
+                                          excerpt=excerpt)
+        return {'locations': [], 'classifiers': [], 'records': [],
+                'error': [message], 'errors': [record], 'cache': '',
+                'timeout': False}
+
+def extract_many(sources, executor=None, backend=backends.default_backend,
+                 budget=None, excerpt=200, encoding='utf-8', ahead=None,
+                 directory=None):
+    """Generate the results of each of a batch of treatments as they finish.
+
+    Parameters:
+        sources - an iterable of treatments, each the path of a pdf (a str
+                  or path-like object), the bytes of a pdf, the bytes of its
+                  text in encoding, or its text as a str; bytes are a pdf
+                  if "%PDF" is in their first 1024 bytes, and a str is text
+                  if it's a TreatmentText or has a line break in it
+        executor - the concurrent.futures executor (threads or processes) to
+                   extract with (defaults to None, meaning the treatments are
+                   extracted one after another in this thread, in order)
+        backend - the name of the pdf text backend (defaults to
+                  backends.default_backend)
+        budget - how many seconds parsing each treatment may take, as
+                 described by extract.extract_from (defaults to None)
+        excerpt - how much of the text of each error to keep, as described by
+                  extract.extract_from (defaults to 200)
+        encoding - the encoding of the text (defaults to utf-8)
+        ahead - with an executor, how many treatments can be handed to it
+                before the first one is generated (defaults to None, meaning
+                all of them)
+        directory - the directory relative paths are in (defaults to the
+                    working directory when the first treatment is read)
+
+    Generates a (source, results) pair for each treatment, where results has
+    the format of extract.extract_from's. With an executor, the pairs are
+    generated in the order the treatments finish in.
+
+    The text of pdfs isn't cached.
+    """
+    # Build the shared state before threads can race to build it
+    extract.warm_up()
+
+    # Changing the working directory during the batch doesn't move the paths.
+    # Treatments given as text are named by their place in the batch rather
+    # than by the text itself.
+    root = Path(directory or os.getcwd()).absolute()
+    def prepare(k, source):
+        if isinstance(source, str) and (isinstance(source, TreatmentText) or
+                                        '\n' in source):
+            return TreatmentText(source), f'treatment {k+1} of the batch'
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return bytes(source), f'treatment {k+1} of the batch'
+        path = root/os.fspath(source)
+        return path, str(path)
+
+    options = {'backend': backend, 'budget': budget, 'excerpt': excerpt,
+               'encoding': encoding}
+    if not executor:
+        for k, source in enumerate(sources):
+            yield source, source_results(*prepare(k, source), **options)
+        return
+
+    pending = {}
+    def finished():
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
+
+    try:
+        for k, source in enumerate(sources):
+            future = executor.submit(source_results, *prepare(k, source),
+                                     **options)
+            pending[future] = source
+            if ahead and len(pending) >= ahead:
+                yield from finished()
+
+        while pending:
+            yield from finished()
+
+    # Don't extract the rest if the results stop being read
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,662 @@
+import re
+import sys
+import json
+import time
+import random
+import timeit
+import tempfile
+import argparse
+import platform
+import textwrap
+import tracemalloc
+
+from . import backends
+from . import cache
+from . import extract
+from . import gazetteer
+
+# Benchmarks of the parsing stages in florana.extract
+#
+# The benchmarks run on synthetic treatment text, so they don't need any pdf
+# files or textract. The pdf backends and extraction drivers are only
+# benchmarked on pdf files given with --pdf. Example usage:
+#
+#   python -m florana.bench
+#   python -m florana.bench backends --pdf Carex.pdf Juncus.pdf
+#   python -m florana.bench drivers --pdf *.pdf
+
+# Location names used in the synthetic location paragraphs
+sample_locations = ['Alta.', 'B.C.', 'Man.', 'N.B.', 'Nfld. and Labr. (Nfld.)',
+                    'Ont.', 'Que.', 'Sask.', 'Yukon', 'Alaska', 'Ariz.',
+                    'Calif.', 'Colo.', 'Idaho', 'Mont.', 'Nev.', 'N.Mex.',
+                    'Oreg.', 'Utah', 'Wash.', 'Wyo.', 'British Columbia',
+                    'Newfoundland and Labrador (Labrador)',
+                    'St. Pierre and Miquelon']
+
+def synthetic_treatment(species=20, subspecies=2, subgroups=1, description=1,
+                        seed=0, genus='Carex'):
+    """Return the text of a made up genus treatment.
+
+    Parameters:
+        species - the number of species in the treatment
+        subspecies - the number of subspecies or varieties of every other
+                     species
+        subgroups - the number of subgroups (sections) the species are split
+                    between, each with its own header and species key
+        description - the number of lines in the description of each species
+                      and subspecies, which sets the size of the text
+        seed - the random seed the text is generated from
+        genus - the name of the genus
+
+    The text has a genus header, a species key for each subgroup, and an
+    introduction, a description and a location paragraph for each species and
+    subspecies, laid out the way extract_from expects pdf text to be.
+    """
+    rand = random.Random(seed)
+
+    def word():
+        return ''.join(rand.choice('aeioulnrstmc')
+                       for _ in range(rand.randint(4, 9)))
+
+    def describe():
+        return ''.join(f'{word().capitalize()} {word()} {word()}, {word()} '
+                       f'{rand.randint(1, 90)}–{rand.randint(1, 90)} cm.\n'
+                       for _ in range(description))
+
+    def locations():
+        locs = rand.sample(sample_locations, rand.randint(1, 8))
+        half = len(locs)//2+1
+
+        # Countries are separated by ';' and the paragraph may wrap lines
+        canada, us = ', '.join(locs[:half]), ',\n'.join(locs[half:])
+        us = '; '+us if us else ''
+        return f'Fruiting summer. Moist woods; 0–{rand.randint(1, 30)}00 m; '\
+               f'{canada}{us}; Europe.\n\n'
+
+    # Species names have to be unique
+    names = list(dict.fromkeys(word() for _ in range(species)))
+    while len(names) < species:
+        names = list(dict.fromkeys(names+[word()]))
+
+    lines = ['Flora of North America\n\n',
+             f'1. {genus.upper()} Linnaeus, Sp. Pl. 2: 972. 1753\n',
+             'Plants perennial.\n\n']
+
+    numbered = list(enumerate(names, 1))
+    per_group = -(-len(numbered)//max(subgroups, 1))
+    for group in range(0, len(numbered), per_group):
+        if subgroups > 1:
+            letter = chr(ord('a')+group//per_group)
+            lines.append(f'1{letter}. {genus.upper()} sect. '
+                         f'{word().upper()}\n\n')
+
+        # The species key
+        for n, name in numbered[group:group+per_group]:
+            lines.append(f'1. Leaves {word()} ........ {n}. {genus} {name}\n')
+        lines.append('\n')
+
+        for n, name in numbered[group:group+per_group]:
+            lines.append(f'{n}. {genus} {name} {word().capitalize()}, '
+                         f'Bot. Gaz. 9: {n}. 1884 E\n')
+            lines.append(describe())
+            if n % 2 == 0 and subspecies:
+                lines.append(f'Subspecies {subspecies}: w North America.\n')
+                for k in range(subspecies):
+                    letter = chr(ord('a')+k)
+                    rank = rand.choice(('subsp.', 'subsp.', 'var.'))
+                    lines.append(f'{n}{letter}. {genus} {name} '
+                                 f'{word().capitalize()} {rank} {word()} F\n')
+                    lines.append(describe())
+                    lines.append(locations())
+            else:
+                lines.append(locations())
+
+    lines.append('OTHER REFERENCES\nBall, P. W. 1990. Canad. J. Bot. 68: 1.\n')
+    return ''.join(lines)
+
+def best_time(stmt, repeat=5):
+    """Return the best time (in seconds) of running stmt once."""
+    timer = timeit.Timer(stmt)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number))/number
+
+def bench_stages(species=200, subspecies=2, subgroups=1, description=1,
+                 seed=0):
+    """Time each parsing stage of extract_from on a synthetic treatment.
+
+    Parameters are passed on to synthetic_treatment.
+
+    Returns a dict mapping each stage to its time in seconds along with its
+    throughput in MB of text and in species per second.
+    """
+    text = synthetic_treatment(species=species, subspecies=subspecies,
+                               subgroups=subgroups, description=description,
+                               seed=seed)
+    genus = extract.genus_in(text)
+
+    # The input of each stage, as partition would produce it
+    groups = list(extract.subgroups(text))
+    keys = [key for group in groups for key in extract.keys_in(group, genus)]
+    names = list(dict.fromkeys(' '.join(key.split(' ')[1:3]).strip()
+                               for key in keys))
+    species_blocks = list(extract.species_blocks(text, names))
+    blocks = [block for block, _ in extract.partition(text, genus)]
+
+    # Each stage, with the amount of text it reads and the number of species
+    # (including subspecies) it handles
+    stages = {
+        'subgroups': (lambda: list(extract.subgroups(text)),
+                      len(text), len(names)),
+        'keys_in': (lambda: [list(extract.keys_in(group, genus))
+                             for group in groups],
+                    sum(map(len, groups)), len(names)),
+        'species_blocks': (lambda: list(extract.species_blocks(text, names)),
+                           len(text), len(names)),
+        'subspecies_blocks': (lambda: [list(extract.subspecies_blocks(*block))
+                                       for block in species_blocks],
+                              sum(len(block) for block, _ in species_blocks),
+                              len(names)),
+        'partition': (lambda: list(extract.partition(text, genus)),
+                      len(text), len(blocks)),
+        'ids_in': (lambda: [extract.ids_in(block) for block in blocks],
+                   sum(map(len, blocks)), len(blocks)),
+        'locs_in': (lambda: [list(extract.locs_in(block))
+                             for block in blocks],
+                    sum(map(len, blocks)), len(blocks)),
+        'analyze_block': (lambda: [extract.analyze_block(block)
+                                   for block in blocks],
+                          sum(map(len, blocks)), len(blocks)),
+    }
+
+    print(f'{len(names)} species and {len(blocks)-len(names)} subspecies in '
+          f'{len(text)/1e6:.2f} MB of text')
+    print(f'{"stage":>18} {"time (ms)":>10} {"MB/s":>8} {"species/s":>10}')
+    results = {}
+    for stage, (run, size, count) in stages.items():
+        seconds = best_time(run)
+        results[stage] = {'seconds': seconds, 'MB/s': size/1e6/seconds,
+                          'species/s': count/seconds}
+        print(f'{stage:>18} {seconds*1000:>10.2f} '
+              f'{size/1e6/seconds:>8.2f} {count/seconds:>10.0f}')
+    return results
+
+def bench_indexer(species=200, subspecies=2, subgroups=1, description=1,
+                  seed=0):
+    """Compare finding species introductions by name and with an IntroIndex.
+
+    Parameters are passed on to synthetic_treatment, which is generated with
+    up to the given number of species to show how both approaches scale.
+
+    Searching by name builds an intro pattern for every species and searches
+    the treatment from the start each time, so its cost grows with the square
+    of the number of species. The index scans the treatment once.
+    """
+    sizes = sorted({max(species//n, 1) for n in (8, 4, 2, 1)})
+
+    print(f'{"species":>8} {"size (kB)":>10} {"by name (ms)":>13} '
+          f'{"indexed (ms)":>13} {"speed-up":>9}')
+    results = {}
+    for size in sizes:
+        text = synthetic_treatment(species=size, subspecies=subspecies,
+                                   subgroups=subgroups,
+                                   description=description, seed=seed)
+        genus = extract.genus_in(text)
+        key_pattern = extract.build_key_pattern(genus)
+        names = [key[2].split(' ')[1] for key in key_pattern.finditer(text)]
+
+        def by_name():
+            for name in names:
+                extract.build_intro_pattern(genus, species=name).search(text)
+
+        def indexed():
+            index = extract.IntroIndex(text, genus)
+            for name in names:
+                index.species_start(name)
+
+        old, new = best_time(by_name), best_time(indexed)
+        results[f'by name ({size} species)'] = {'seconds': old}
+        results[f'indexed ({size} species)'] = {'seconds': new}
+        print(f'{size:>8} {len(text)/1000:>10.1f} {old*1000:>13.2f} '
+              f'{new*1000:>13.2f} {old/new:>8.1f}x')
+    return results
+
+def alternation_pattern(names):
+    """Compile the location names into one alternation, longest name first.
+
+    This is how locations were found before LocationTrie, kept to compare
+    against.
+    """
+    alternatives = []
+    for name in names:
+        for r in ('.', '(', ')'):
+            name = name.replace(r, '\\'+r)
+        alternatives.append('(?:'+name+')')
+    alternatives = sorted((loc.replace(' ', r'\s*') for loc in alternatives),
+                          key=len, reverse=True)
+    return re.compile(r'[^;,]\s*('+'|'.join(alternatives)+
+                      r')(?:[;,]|\s*?$|\s*?\n)', re.MULTILINE)
+
+def bench_locations(species=200, subspecies=2, subgroups=1, description=1,
+                    seed=0):
+    """Compare finding locations with the alternation and with LocationTrie.
+
+    Parameters are passed on to synthetic_treatment, whose location
+    paragraphs are searched.
+    """
+    names = gazetteer.load_names()
+    pattern = alternation_pattern(names)
+    trie = gazetteer.LocationTrie(names)
+
+    text = synthetic_treatment(species=species, subspecies=subspecies,
+                               subgroups=subgroups, description=description,
+                               seed=seed)
+    genus = extract.genus_in(text)
+    spans = (extract.loc_span(text, start, end)
+             for start, end, _, _ in extract.partition_spans(text, genus))
+    paragraphs = [text[span[0]:span[1]] for span in spans if span]
+    if [pattern.findall(p) for p in paragraphs] != \
+       [trie.findall(p) for p in paragraphs]:
+        raise AssertionError('LocationTrie found different locations')
+
+    def alternation():
+        for paragraph in paragraphs:
+            pattern.findall(paragraph)
+
+    def with_trie():
+        for paragraph in paragraphs:
+            trie.findall(paragraph)
+
+    size = sum(map(len, paragraphs))
+    old, new = best_time(alternation), best_time(with_trie)
+    print(f'{"paragraphs":>10} {"size (kB)":>10} {"alternation (ms)":>17} '
+          f'{"trie (ms)":>10} {"speed-up":>9}')
+    print(f'{len(paragraphs):>10} {size/1000:>10.1f} {old*1000:>17.2f} '
+          f'{new*1000:>10.2f} {old/new:>8.1f}x')
+    return {'alternation': {'seconds': old, 'MB/s': size/1e6/old},
+            'trie': {'seconds': new, 'MB/s': size/1e6/new}}
+
+def bench_blocks(species=200, subspecies=2, subgroups=1, description=1,
+                 seed=0):
+    """Time analyzing a species block, step by step.
+
+    Parameters are passed on to synthetic_treatment, with one and ten times
+    as many description lines, since the classifiers and the locations
+    paragraph are at opposite ends of a block.
+
+    The blocks are analyzed in place in the treatment text, as
+    species_records does. Returns the time per block of finding the
+    classifiers, the locations paragraph and its locations, and of
+    analyze_block as a whole.
+    """
+    extract.warm_up()
+    print(f'{"blocks":>7} {"size (B)":>9} {"ids_in (us)":>12} '
+          f'{"loc_span (us)":>14} {"locations (us)":>15} {"total (us)":>11}')
+    results = {}
+    for lines in (description, description*10):
+        text = synthetic_treatment(species=species, subspecies=subspecies,
+                                   subgroups=subgroups, description=lines,
+                                   seed=seed)
+        genus = extract.genus_in(text)
+        spans = [(start, end) for start, end, _, _
+                 in extract.partition_spans(text, genus)]
+        paragraphs = [span for span in (extract.loc_span(text, start, end)
+                                        for start, end in spans) if span]
+
+        analyzed = [extract.analyze_block(text, start, end)
+                    for start, end in spans]
+        if analyzed != [(extract.ids_in(text, start, end),
+                         tuple(extract.locs_in(text, start, end)))
+                        for start, end in spans]:
+            raise AssertionError('analyze_block found something different')
+
+        steps = {
+            'ids_in': lambda: [extract.ids_in(text, start, end)
+                               for start, end in spans],
+            'loc_span': lambda: [extract.loc_span(text, start, end)
+                                 for start, end in spans],
+            'span_locations': lambda: [extract.span_locations(text, *span)
+                                       for span in paragraphs],
+            'analyze_block': lambda: [extract.analyze_block(text, start, end)
+                                      for start, end in spans],
+        }
+        times = {step: best_time(run)/len(spans)
+                 for step, run in steps.items()}
+        size = sum(end-start for start, end in spans)//len(spans)
+        print(f'{len(spans):>7} {size:>9} {times["ids_in"]*1e6:>12.2f} '
+              f'{times["loc_span"]*1e6:>14.2f} '
+              f'{times["span_locations"]*1e6:>15.2f} '
+              f'{times["analyze_block"]*1e6:>11.2f}')
+        for step, seconds in times.items():
+            results[f'{step}, {lines} lines'] = {'seconds': seconds}
+    return results
+
+def bench_partitions(species=200, subspecies=2, subgroups=1, description=1,
+                     seed=0):
+    """Compare parsing a treatment with and without its partition cached.
+
+    Parameters are passed on to synthetic_treatment.
+
+    With the partition cached, a treatment is parsed the way it is when only
+    the location rules or the gazetteer have changed since the last run.
+    """
+    text = synthetic_treatment(species=species, subspecies=subspecies,
+                               subgroups=subgroups, description=description,
+                               seed=seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        partitions = cache.PartitionCache(directory)
+        list(extract.species_records(text, partitions=partitions))
+
+        def partitioned():
+            list(extract.species_records(text))
+
+        def cached():
+            list(extract.species_records(text, partitions=partitions))
+
+        old, new = best_time(partitioned), best_time(cached)
+
+    print(f'{len(text)/1e6:.2f} MB of text')
+    print(f'{"partitioned (ms)":>17} {"cached (ms)":>12} {"speed-up":>9}')
+    print(f'{old*1000:>17.2f} {new*1000:>12.2f} {old/new:>8.1f}x')
+    return {'partitioned': {'seconds': old}, 'cached': {'seconds': new}}
+
+def peak_memory(run):
+    """Return the peak memory (in bytes) allocated while calling run."""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    run()
+    peak = tracemalloc.get_traced_memory()[1]-start
+    if not tracing:
+        tracemalloc.stop()
+    return peak
+
+def bench_memory(species=200, subspecies=2, subgroups=1, description=1,
+                 seed=0):
+    """Compare the memory of parsing blocks in place and of slicing them.
+
+    Parameters are passed on to synthetic_treatment, with ten times as many
+    description lines to make a large treatment.
+
+    species_records searches each block within the treatment text, while
+    slicing copies every subgroup and species block out of the text before
+    searching it, which is how the text was parsed before. The peak memory
+    of each is also given in copies of the treatment text.
+    """
+    text = synthetic_treatment(species=species, subspecies=subspecies,
+                               subgroups=subgroups,
+                               description=description*10, seed=seed)
+    genus = extract.genus_in(text)
+
+    def sliced():
+        for group in extract.subgroups(text):
+            list(extract.keys_in(group, genus))
+        for block, name in extract.partition(text, genus):
+            extract.ids_in(block)
+            list(extract.locs_in(block))
+
+    def in_place():
+        for record in extract.species_records(text):
+            pass
+
+    print(f'{len(text)/1e6:.2f} MB of text')
+    print(f'{"":>9} {"time (ms)":>10} {"peak (kB)":>10} {"text copies":>12}')
+    results = {}
+    for name, run in (('sliced', sliced), ('in place', in_place)):
+        seconds, peak = best_time(run), peak_memory(run)
+        results[name] = {'seconds': seconds, 'peak memory': peak}
+        print(f'{name:>9} {seconds*1000:>10.2f} {peak/1000:>10.1f} '
+              f'{peak/len(text):>12.2f}')
+    return results
+
+def bench_backends(species=200, subspecies=2, subgroups=1, description=1,
+                   seed=0, pdfs=(), repeat=3):
+    """Compare the time and output of each pdf backend on the same pdfs.
+
+    Parameters:
+        pdfs - the pdf files to extract text from
+        repeat - how many times to extract each pdf, keeping the best time
+                 (defaults to 3)
+
+    The synthetic treatment parameters are ignored, since the backends need
+    real pdf files. The time is reported per page, where pages are counted by
+    the form feeds that end them in the extracted text. The output of each
+    backend is compared with the output of the first available backend by
+    the species records florana extracts from it.
+    """
+    if not pdfs:
+        print('No pdf files to benchmark the backends on (use --pdf)')
+        return {}
+
+    available = [backend for backend in backends.backends.values()
+                 if backend.available()]
+    for backend in backends.backends.values():
+        if backend not in available:
+            print(f'{backend.name} is not installed, skipping it')
+
+    def records(text):
+        try:
+            return [(record.name, record.classifiers, record.locations)
+                    for record in extract.species_records(text)]
+        except ValueError:
+            return []
+
+    print(f'{"backend":>10} {"pages":>6} {"time (ms)":>10} {"ms/page":>8} '
+          f'{"species":>8} {"locations":>10} {"same output":>12}')
+    results = {}
+    expected = None
+    for backend in available:
+        seconds = pages = 0
+        found = []
+        for pdf in pdfs:
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                text = backend.text(pdf)
+                best = min(best, time.perf_counter()-start)
+            seconds += best
+            pages += max(text.count('\f'), 1)
+            found.append(records(text))
+
+        if expected is None:
+            expected = found
+        species = sum(map(len, found))
+        locations = sum(len(locs) for pdf in found for _, _, locs in pdf)
+        same = 'yes' if found == expected else 'no'
+        results[backend.name] = {'seconds': seconds,
+                                 'seconds/page': seconds/pages,
+                                 'species': species, 'locations': locations,
+                                 'same output': found == expected}
+        print(f'{backend.name:>10} {pages:>6} {seconds*1000:>10.1f} '
+              f'{seconds/pages*1000:>8.2f} {species:>8} {locations:>10} '
+              f'{same:>12}')
+    return results
+
+def bench_drivers(species=200, subspecies=2, subgroups=1, description=1,
+                  seed=0, pdfs=(), workers=4):
+    """Compare the time to extract pdfs one at a time, with worker processes
+    and with the asyncio pipeline.
+
+    Parameters:
+        pdfs - the pdf files to extract
+        workers - the number of worker processes and of conversions at a
+                  time (defaults to 4)
+
+    The synthetic treatment parameters are ignored, since the pdfs have to be
+    converted. Nothing is cached, so every pdf is converted each time.
+    """
+    if not pdfs:
+        print('No pdf files to benchmark the drivers on (use --pdf)')
+        return {}
+
+    drivers = {'sequential': {},
+               f'{workers} processes': {'jobs': workers},
+               f'{workers} conversions': {'conversions': workers}}
+
+    print(f'{"driver":>15} {"time (s)":>9} {"treatments/s":>13} '
+          f'{"speed-up":>9}')
+    results = {}
+    for name, options in drivers.items():
+        start = time.perf_counter()
+        for _ in extract.extract_all(list(pdfs), **options):
+            pass
+        seconds = time.perf_counter()-start
+        results[name] = {'seconds': seconds}
+        speed_up = results['sequential']['seconds']/seconds
+        print(f'{name:>15} {seconds:>9.2f} {len(pdfs)/seconds:>13.1f} '
+              f'{speed_up:>8.1f}x')
+    return results
+
+def pathological_cases(repeats, genus='Carex'):
+    """Return malformed text that used to take quadratic time or worse.
+
+    Parameters:
+        repeats - how many times each malformed piece is repeated, which sets
+                  the size of the text
+        genus - the name of the genus
+
+    Maps the name of each case to a function parsing its text.
+    """
+    # Location paragraph starts that never end a line with a '.'
+    unended = 'Flowering spring; Moist woods; 0–100 m; Alta., Ont. '*repeats
+
+    # A flowering time that's never followed by a ';'
+    flowering = 'Flowering spring, Moist woods, Alta., Ont. '*repeats
+
+    # Subspecies introductions without a subspecies name
+    intros = f'1. {genus} aquatilis\n'+\
+             f'1a. {genus} aquatilis subsp. X\n'*repeats
+    index = extract.IntroIndex(intros, genus)
+
+    return {'locations without an end': lambda: list(extract.locs_in(unended)),
+            'flowering without a ;': lambda: list(extract.locs_in(flowering)),
+            'unnamed subspecies': lambda: list(extract.subspecies_spans(
+                    index, f'{genus} aquatilis', 0, len(intros)))}
+
+def bench_pathological(species=200, subspecies=2, subgroups=1, description=1,
+                       seed=0):
+    """Time parsing malformed text of growing size.
+
+    Parameters:
+        species - the text of each case is made of 10 times as many malformed
+                  pieces, then twice and four times that (defaults to 200)
+
+    The other synthetic treatment parameters are ignored. Each case should
+    take about twice as long when its text is twice as long; it's flagged if
+    it grows faster than that, since text like this took minutes to parse
+    when the patterns backtracked.
+    """
+    sizes = [species*10, species*20, species*40]
+
+    print(f'{"case":>26} {"pieces":>7} {"time (ms)":>10} {"growth":>7}')
+    results = {}
+    for case in pathological_cases(1):
+        last = None
+        for repeats in sizes:
+            seconds = best_time(pathological_cases(repeats)[case], repeat=3)
+            results[f'{case} ({repeats})'] = {'seconds': seconds}
+            growth = f'{seconds/last:.1f}x' if last else ''
+            if last and seconds/last > 3:
+                growth += ' (superlinear!)'
+            print(f'{case:>26} {repeats:>7} {seconds*1000:>10.2f} '
+                  f'{growth:>7}')
+            last = seconds
+    return results
+
+benchmarks = {'stages': bench_stages,
+              'indexer': bench_indexer,
+              'locations': bench_locations,
+              'blocks': bench_blocks,
+              'memory': bench_memory,
+              'partitions': bench_partitions,
+              'pathological': bench_pathological,
+              'backends': bench_backends,
+              'drivers': bench_drivers}
+
+def compare(results, saved):
+    """Print how much faster each result is than the same saved result."""
+    print(f'{"benchmark":>40} {"saved (ms)":>11} {"now (ms)":>10} '
+          f'{"speed-up":>9}')
+    for name, measurements in results.items():
+        for measurement, result in measurements.items():
+            try:
+                old = saved['results'][name][measurement]['seconds']
+            except KeyError:
+                continue
+            new = result['seconds']
+            print(f'{name+": "+measurement:>40} {old*1000:>11.2f} '
+                  f'{new*1000:>10.2f} {old/new:>8.2f}x')
+
+def main():
+    description = '''
+            Benchmark the parsing stages of florana.extract on synthetic
+            treatment text.
+
+            Example usage:
+
+                python -m florana.bench --save before.json
+                python -m florana.bench --compare before.json
+    '''
+    prog = 'python -m florana.bench'
+
+    fmt_class = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=fmt_class,
+                                     description=textwrap.dedent(description),
+                                     prog=prog)
+    parser.add_argument('benchmarks', metavar='B', nargs='*',
+                        help='the benchmarks to run: '+', '.join(benchmarks)+
+                             ' (defaults to all of them)')
+    parser.add_argument('--species', type=int, default=200, metavar='N',
+                        help='the number of species in the synthetic '
+                             'treatment (defaults to %(default)s)')
+    parser.add_argument('--subspecies', type=int, default=2, metavar='N',
+                        help='the number of subspecies of every other '
+                             'species (defaults to %(default)s)')
+    parser.add_argument('--subgroups', type=int, default=1, metavar='N',
+                        help='the number of subgroups the species are split '
+                             'between (defaults to %(default)s)')
+    parser.add_argument('--description', type=int, default=1, metavar='N',
+                        help='the number of description lines of each '
+                             'species, to adjust the size of the text '
+                             '(defaults to %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='the random seed of the synthetic text '
+                             '(defaults to %(default)s)')
+    parser.add_argument('--pdf', nargs='+', default=[], metavar='FILE',
+                        help='the pdf files to benchmark the backends on')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results to a json file')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results to results saved earlier')
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error(f'unknown benchmark "{name}"')
+
+    options = {'species': args.species, 'subspecies': args.subspecies,
+               'subgroups': args.subgroups, 'description': args.description,
+               'seed': args.seed}
+
+    results = {}
+    for name in args.benchmarks or benchmarks:
+        print(f'--- {name} ---')
+        if name in ('backends', 'drivers'):
+            results[name] = benchmarks[name](pdfs=args.pdf, **options)
+        else:
+            results[name] = benchmarks[name](**options)
+
+    if args.compare:
+        print(f'--- compared to {args.compare} ---')
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version, 'platform': platform.platform(),
+                       'options': options, 'results': results}, f, indent=1)
+
+if __name__ == '__main__':
+    main()
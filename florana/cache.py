@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from pathlib import Path
+
+# Where the text of each treatment is cached when no directory is given
+default_dir = Path(os.environ.get('XDG_CACHE_HOME',
+                                  Path.home()/'.cache'))/'florana'
+
+# The default size limit of the cache directory (in bytes)
+default_size = 512*1024*1024
+
+# The text and partition caches share the cache directory and its size limit.
+# A partition is a few numbers for each species block, so it's much smaller
+# than the text it's of, and the partitions get this share of the limit.
+partition_share = 1/8
+
+def split_size(max_size):
+    """Return the size limits of the text and partition caches.
+
+    Parameters:
+        max_size - the size limit of the whole cache directory in bytes
+    """
+    partition_size = int(max_size*partition_share)
+    return max_size-partition_size, partition_size
+
+def file_hash(path, chunk_size=1024*1024):
+    """Return the sha256 hex digest of the contents of a file.
+
+    Parameters:
+        path - the path of the file to hash
+        chunk_size - how many bytes to read at a time
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class TextCache:
+    """A content-addressed, size-limited cache of extracted treatment text.
+
+    Entries are keyed by the hash of the pdf contents along with the settings
+    used to extract its text, so renaming or moving a pdf doesn't invalidate
+    its entry, but changing its contents or the extractor does. When the cache
+    grows past its size limit the least recently used entries are removed.
+
+    Parameters:
+        directory - where to store the cached text (defaults to default_dir)
+        max_size - the size limit of the cache in bytes (defaults to
+                   default_size)
+    """
+    # The file extension of the cached entries
+    suffix = '.txt'
+
+    def __init__(self, directory=default_dir, max_size=default_size):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path, encoding, backend):
+        """Return the cache key of a pdf extracted with the given settings.
+
+        Parameters:
+            path - the path of the pdf file
+            encoding - the encoding the text is extracted with
+            backend - the name of the program the text is extracted with
+        """
+        settings = f'{file_hash(path)}:{backend}:{encoding}'
+        return hashlib.sha256(settings.encode('utf8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached text for key, or None if it isn't cached."""
+        path = self.directory/(key+self.suffix)
+        try:
+            with open(path, encoding='utf8') as f:
+                text = f.read()
+
+        # The text was never cached or another process has evicted it
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        # Mark the entry as recently used so it's evicted last
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return text
+
+    def put(self, key, text):
+        """Cache the text for key, evicting old entries if the cache is full."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first so that other processes never read
+        # a partially written entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as f:
+                f.write(text)
+            os.replace(tmp, self.directory/(key+self.suffix))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits."""
+        entries = []
+        for path in self.directory.glob('*'+self.suffix):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+class PartitionCache(TextCache):
+    """A size-limited cache of how treatment texts were partitioned.
+
+    Entries are keyed by the hash of the treatment text along with the
+    version of the partitioner (see extract.partitioner_version), so the
+    treatments don't have to be partitioned again when only the way blocks
+    are parsed changes. The partition of a treatment is a dict of its genus
+    and the (start, end, name, rank) of each species block, in order.
+
+    Parameters:
+        directory - where to store the cached partitions (defaults to the
+                    "partitions" directory in default_dir)
+        max_size - the size limit of the cache in bytes (defaults to
+                   default_size)
+    """
+    suffix = '.json'
+
+    def __init__(self, directory=default_dir/'partitions',
+                 max_size=default_size):
+        super().__init__(directory, max_size=max_size)
+
+    def key(self, text, version):
+        """Return the cache key of a treatment text partitioned by version.
+
+        Parameters:
+            text - the treatment text
+            version - the version of the partitioner
+        """
+        text_hash = hashlib.sha256(text.encode('utf8')).hexdigest()
+        settings = f'{text_hash}:partition:{version}'
+        return hashlib.sha256(settings.encode('utf8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached partition for key, or None if it isn't cached."""
+        partition = super().get(key)
+        if partition is None:
+            return None
+        partition = json.loads(partition)
+        partition['spans'] = [tuple(span) for span in partition['spans']]
+        return partition
+
+    def put(self, key, partition):
+        """Cache the partition for key, evicting old entries if needed."""
+        super().put(key, json.dumps(partition))
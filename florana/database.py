@@ -0,0 +1,166 @@
+import sqlite3
+
+# --- SQLite output ---
+#
+# The extracted data is stored in normalized tables so it can be queried
+# without reading the csv files back in:
+#
+#   treatments          - each treatment (pdf) extracted into the database
+#   species             - each species and subspecies, with its treatment
+#   locations           - each state and province
+#   species_locations   - which species appear in which locations
+#   classifiers         - the classifier codes, with what they mean
+#   species_classifiers - the classifiers of each species
+#
+# A database can be added to by later runs. Extracting a treatment that's
+# already in the database replaces its species.
+
+schema = '''
+CREATE TABLE IF NOT EXISTS treatments (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS species (
+    id INTEGER PRIMARY KEY,
+    treatment_id INTEGER NOT NULL REFERENCES treatments ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    genus TEXT NOT NULL,
+    species TEXT NOT NULL,
+    rank TEXT NOT NULL,
+    infraspecies TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS locations (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS species_locations (
+    species_id INTEGER NOT NULL REFERENCES species ON DELETE CASCADE,
+    location_id INTEGER NOT NULL REFERENCES locations,
+    PRIMARY KEY (species_id, location_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS classifiers (
+    code TEXT PRIMARY KEY,
+    description TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS species_classifiers (
+    species_id INTEGER NOT NULL REFERENCES species ON DELETE CASCADE,
+    code TEXT NOT NULL REFERENCES classifiers,
+    PRIMARY KEY (species_id, code)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS species_name ON species (name);
+CREATE INDEX IF NOT EXISTS species_treatment ON species (treatment_id);
+CREATE INDEX IF NOT EXISTS location_species
+    ON species_locations (location_id, species_id);
+CREATE INDEX IF NOT EXISTS classifier_species
+    ON species_classifiers (code, species_id);
+
+CREATE VIEW IF NOT EXISTS occurrences AS
+    SELECT species.name AS species, locations.name AS location
+    FROM species_locations
+    JOIN species ON species.id = species_locations.species_id
+    JOIN locations ON locations.id = species_locations.location_id;
+'''
+
+# The classifiers used by Flora of North America
+classifier_descriptions = {'C': 'of conservation concern',
+                           'E': 'endemic',
+                           'F': 'illustrated',
+                           'I': 'introduced',
+                           'W': 'weedy'}
+
+class SpeciesDatabase:
+    """An SQLite database of the data extracted from treatments.
+
+    Parameters:
+        path - the file name of the database, which is created if it doesn't
+               exist and added to if it does
+
+    Use it as a context manager to close the database when done.
+    """
+    def __init__(self, path):
+        self.path = path
+
+        # Transactions are handled by add_treatment
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.executescript(schema)
+        self.connection.executemany(
+                'INSERT OR IGNORE INTO classifiers VALUES (?, ?)',
+                classifier_descriptions.items())
+
+        # The ids of the locations already in the database
+        self.location_ids = dict(self.connection.execute(
+                'SELECT name, id FROM locations'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
+
+    def add_treatment(self, treatment, records):
+        """Store the species records of a treatment in one transaction.
+
+        Parameters:
+            treatment - the name of the treatment (its pdf file name)
+            records - the SpeciesRecords extracted from the treatment
+
+        If the treatment was already in the database, its old species are
+        replaced.
+        """
+        db = self.connection
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('DELETE FROM treatments WHERE name = ?', (treatment,))
+            treatment_id = db.execute('INSERT INTO treatments (name) '
+                                      'VALUES (?)', (treatment,)).lastrowid
+
+            # Species ids are handed out here so every table can be inserted
+            # into in one batch. No one else can write while the transaction
+            # holds the write lock.
+            first_id = db.execute('SELECT coalesce(max(id), 0)+1 '
+                                  'FROM species').fetchone()[0]
+            species, locations, classifiers = [], [], []
+            for species_id, record in enumerate(records, first_id):
+                species.append((species_id, treatment_id, record.name,
+                                record.genus, record.species, record.rank,
+                                record.infraspecies))
+                locations.extend((species_id, self.location_id(location))
+                                 for location in record.locations)
+                classifiers.extend((species_id, code)
+                                   for code in record.flags
+                                   if code in classifier_descriptions)
+
+            db.executemany('INSERT INTO species VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           species)
+            db.executemany('INSERT OR IGNORE INTO species_locations '
+                           'VALUES (?, ?)', locations)
+            db.executemany('INSERT OR IGNORE INTO species_classifiers '
+                           'VALUES (?, ?)', classifiers)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+
+            # Locations added in the transaction are gone again
+            self.location_ids = dict(db.execute('SELECT name, id '
+                                                'FROM locations'))
+            raise
+
+    def location_id(self, location):
+        """Return the id of a location, adding it to the database if needed."""
+        try:
+            return self.location_ids[location]
+        except KeyError:
+            location_id = self.connection.execute(
+                    'INSERT INTO locations (name) VALUES (?)',
+                    (location,)).lastrowid
+            self.location_ids[location] = location_id
+            return location_id
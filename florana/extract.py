@@ -1,19 +1,27 @@
-import textract
 import re
+import csv
 import json
 import argparse
 import os
+import time
 import textwrap
 import itertools
+import functools
+import bisect
+import contextlib
 
 from pathlib import Path
-from collections import OrderedDict
+from collections import OrderedDict, Counter, namedtuple
+
+from . import backends
+from . import cache as text_cache
+from . import gazetteer
+from . import manifest
+from . import profiling
 
 file_dir = Path(__file__).parent.absolute()
 cwd = Path()
 
-# TODO: Recursively iterate through a directory
-
 # Data to extract:
 #   species name | states and provinces it appears in | classifier
 
@@ -38,164 +46,905 @@ def main():
                                      prog=prog)
     parser.add_argument('-A', action='store_true',
                         help='parse all pdf files in the current directory')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='with -A, also parse the pdf files in every '
+                             'subdirectory')
     parser.add_argument('filenames', metavar='F', nargs='*',
-                        help='the treatment files to extract from')
+                        help='the treatment files to extract from; '
+                             'directories are searched recursively')
     parser.add_argument('-o', action='store',
                         help='specify a single output file (csv)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='extract from N treatments at a time using a '
+                             'pool of worker processes (defaults to 1)')
+    parser.add_argument('--conversions', type=int, default=0, metavar='N',
+                        help='convert N pdfs to text at a time while parsing '
+                             'the converted ones, all in one process')
+    parser.add_argument('--time-budget', type=float, default=60.0,
+                        metavar='SECONDS',
+                        help='give up on the rest of a treatment once '
+                             'parsing it has taken SECONDS, recording a '
+                             'timeout error; 0 means no limit (defaults to '
+                             '%(default)s)')
+    parser.add_argument('--error-excerpt', type=int, default=200,
+                        metavar='CHARS',
+                        help='how much of the text of each error to keep in '
+                             'errors.jsonl (defaults to %(default)s)')
+    parser.add_argument('--error-blocks', action='store_true',
+                        help='keep the whole block of text of each error in '
+                             'errors.jsonl instead of an excerpt')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        default=text_cache.default_dir,
+                        help='where to cache the text extracted from each pdf '
+                             f'(defaults to {text_cache.default_dir})')
+    parser.add_argument('--cache-size', type=int, metavar='MB',
+                        default=text_cache.default_size//(1024*1024),
+                        help='the size limit of the cache directory in '
+                             'megabytes, shared by the text and partitions; '
+                             'the least recently used entries are removed '
+                             'first (defaults to %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't cache the text extracted from each pdf "
+                             "or how it was partitioned")
+    parser.add_argument('--profile', metavar='REPORT',
+                        help='record the wall time, cpu time and peak memory '
+                             'of each treatment and extraction stage in a '
+                             'json report')
+    parser.add_argument('--cprofile', type=int, default=0, metavar='N',
+                        help='with --profile, also dump cProfile stats of the '
+                             'N slowest treatments next to the report')
+    parser.add_argument('--watch', metavar='DIR',
+                        help='keep running and extract every pdf that is '
+                             'added to or changed in DIR (and its '
+                             'subdirectories) with a pool of -j workers')
+    parser.add_argument('--poll', type=float, default=2.0, metavar='SECONDS',
+                        help='with --watch, how often to look for new pdfs '
+                             '(defaults to %(default)s)')
+    parser.add_argument('--incremental', metavar='MANIFEST',
+                        help='only extract treatments that changed since the '
+                             'run that wrote MANIFEST and reuse what was '
+                             'extracted from the rest')
+    parser.add_argument('--sqlite', metavar='PATH',
+                        help='store the data in an SQLite database, adding to '
+                             'it if it exists; csv files are then only '
+                             'written with -o')
+    parser.add_argument('--volume', action='store_true',
+                        help='treat each pdf as a whole volume with the '
+                             'treatments of many genera, parsing one genus at '
+                             'a time (with -j, on each worker)')
+    parser.add_argument('--shard', metavar='I/N',
+                        help='only extract the I-th of N size-balanced shares '
+                             'of the treatments, to be put back together '
+                             'with python -m florana.merge')
+    parser.add_argument('--incidence', metavar='PATH',
+                        help='also save a species by location matrix of the '
+                             'run to PATH (an .npz file); needs numpy')
+    parser.add_argument('--stream', action='store_true',
+                        help='read each pdf one page at a time and stop at '
+                             'the page where the references start')
+    parser.add_argument('--backend', choices=list(backends.backends),
+                        default=backends.default_backend,
+                        help='the program to extract text from each pdf with '
+                             '(defaults to %(default)s)')
 
     success = True
     args = parser.parse_args()
 
+    if args.jobs < 1:
+        raise ValueError('The number of jobs must be at least 1.')
+
+    if args.cprofile and not args.profile:
+        raise ValueError('cProfile stats can only be dumped with --profile.')
+
+    if args.conversions < 0:
+        raise ValueError("The number of conversions can't be negative.")
+
+    if args.time_budget < 0:
+        raise ValueError("The time budget can't be negative.")
+
+    if args.error_excerpt < 0:
+        raise ValueError("The error excerpt can't be negative.")
+    excerpt = None if args.error_blocks else args.error_excerpt
+
+    if args.conversions and (args.jobs > 1 or args.profile):
+        raise ValueError('--conversions runs in one process, so it can\'t be '
+                         'used with -j or --profile.')
+
+    if args.volume and (args.conversions or args.stream or args.profile or
+                        args.watch):
+        raise ValueError("--volume can't be used with --conversions, "
+                         "--stream, --profile or --watch.")
+
+    shard = None
+    if args.shard:
+        if args.watch:
+            raise ValueError("Treatments can't be sharded with --watch.")
+
+        # Imported here since it imports this module
+        from . import merge
+        shard = merge.parse_shard(args.shard)
+
+    # Check for numpy before extracting anything
+    incidence = None
+    if args.incidence:
+        if args.watch:
+            raise ValueError("The incidence matrix can't be saved with "
+                             "--watch.")
+
+        # numpy takes a while to import, so only import it when needed
+        from . import incidence
+        incidence.require_numpy()
+
+    # The partition of each treatment text is cached along with the text, so
+    # runs that only change how blocks are parsed (or the gazetteer) skip
+    # straight to parsing them
+    cache = partitions = None
+    if not args.no_cache:
+        text_size, partition_size = text_cache.split_size(
+                args.cache_size*1024*1024)
+        cache = text_cache.TextCache(args.cache_dir, max_size=text_size)
+        partitions = text_cache.PartitionCache(
+                Path(args.cache_dir)/'partitions', max_size=partition_size)
+
+    previous = None
+    if args.incremental:
+        previous = manifest.Manifest(args.incremental,
+                                     manifest.config_fingerprint(
+                                             args.stream, args.volume,
+                                             excerpt))
+
+    # The user specified to keep extracting pdfs as they're added to a
+    # directory
+    if args.watch:
+        if args.profile:
+            raise ValueError("Treatments can't be profiled with --watch.")
+
+        # Imported here since it imports this module
+        from . import watch
+
+        # Output is added to the files written by earlier runs
+        with OutputSink(args.o, sqlite=args.sqlite, append=True) as sink:
+            watch.watch(args.watch, sink, args.jobs, cache=cache,
+                        backend=args.backend, stream=args.stream,
+                        previous=previous, poll=args.poll,
+                        budget=args.time_budget, partitions=partitions,
+                        excerpt=excerpt)
+        return
+
     treatments = []
 
     # The user specified to parse all pdf files in the directory
     if args.A and not args.filenames:
-        treatments = [fn for fn in os.listdir() if '.pdf' in fn]
+        treatments = list(pdfs_in('', recursive=args.recursive))
 
     # The user specified the files manually
     elif args.filenames:
-        treatments = args.filenames
+        for fn in args.filenames:
+            if os.path.isdir(fn):
+                treatments.extend(pdfs_in(fn, recursive=True))
+            else:
+                treatments.append(fn)
 
     else:
         message = 'Please either specify filenames manually or use the '\
                   '"parse all" flag (-A).'
         raise ValueError(message)
 
-    locations = ''
-    classifiers = ''
-    sep = ''
-    error = ''          # Brief error message for program ouput to console
-    log_error = ''      # Verbose error message for error.log
-
+    # name the csv file after the pdf input
+    pdfs = []
     for treatment in treatments:
-        # name the csv file after the pdf input
-        match = re.match(r'([\w\.]+)\.pdf', treatment)
-        if not match:
+        fn = csv_name(treatment)
+        if not fn:
             print(f'"{treatment}" is not a pdf file!')
             success = False
             continue
-        fn = match[1]
+        pdfs.append((treatment, fn))
+
+    # Every shard hands out the same treatments, each to one shard, so they
+    # all have to agree on the position of each treatment whatever order they
+    # were listed in. Sorting them gives the order -A and directories list
+    # them in, so the merged output is the one a single run writes.
+    names = []
+    positions = range(len(pdfs))
+    if shard:
+        pdfs.sort()
+        names = [treatment for treatment, _ in pdfs]
+        sizes = [os.path.getsize(treatment) for treatment in names]
+        positions = merge.shard_positions(sizes, *shard)
+        pdfs = [pdfs[position] for position in positions]
+
+    # Treatments that haven't changed since the last incremental run aren't
+    # extracted again
+    unchanged = set()
+    if previous:
+        unchanged = {treatment for treatment, _ in pdfs
+                     if previous.unchanged(treatment, args.backend)}
+
+    error = []          # Brief error messages for program ouput to console
+    cache_counts = Counter()
+    profiles = []       # (treatment, profile, cProfile stats) for --profile
+    incidences = []     # the species by location matrix of each treatment
+
+    with OutputSink(args.o, sqlite=args.sqlite,
+                    sizes=bool(shard)) as sink:
+        changed = [treatment for treatment, _ in pdfs
+                   if treatment not in unchanged]
+        if args.volume:
+            # Imported here since it imports this module
+            from . import volume
+            extracted = volume.extract_volumes(changed, args.jobs,
+                                               backend=args.backend,
+                                               budget=args.time_budget,
+                                               partitions=partitions,
+                                               excerpt=excerpt)
+        else:
+            extracted = extract_all(changed, args.jobs, cache=cache,
+                                    backend=args.backend, stream=args.stream,
+                                    profile=bool(args.profile),
+                                    cprofile=args.cprofile > 0,
+                                    conversions=args.conversions,
+                                    budget=args.time_budget,
+                                    partitions=partitions, excerpt=excerpt)
+        for treatment, fn in pdfs:
+            if treatment in unchanged:
+                results = previous.results(treatment)
+            else:
+                results = next(extracted)
+
+                # Treatments that timed out are tried again on the next run
+                if previous and not results['timeout']:
+                    previous.update(treatment, args.backend, results)
+            cache_counts[results['cache']] += 1
+
+            if args.profile and 'profile' in results:
+                profiles.append((treatment, results['profile'],
+                                 results['cprofile']))
+
+                # Only hold on to the cProfile stats of the slowest treatments
+                profiles.sort(key=lambda p: p[1]['wall'], reverse=True)
+                profiles[args.cprofile:] = [(t, p, None) for t, p, _ in
+                                            profiles[args.cprofile:]]
+
+            # If the extracting algorithm couldn't find locations, keep track
+            # of the error messages
+            if results['error']:
+                success = False
+                error.extend(results['error'])
+
+            sink.write(treatment, fn, results)
+            if incidence:
+                incidences.append(incidence.Incidence.from_records(
+                        results['records']))
+
+    if shard:
+        outputs = output_names(args.o) if args.o else None
+        entries = [[position, treatment, *sizes] for position, (treatment, _),
+                   sizes in zip(positions, pdfs, sink.sizes)]
+        merge.write_index(*shard, names, outputs, entries)
+        print(f'Extracted {len(pdfs)} of {len(names)} treatments in shard '
+              f'{args.shard}; wrote its index to {merge.index_name(*shard)}')
+
+    if incidence:
+        merged = incidence.Incidence.merge(incidences)
+        merged.save(args.incidence)
+        print(f'Saved the incidence matrix of {len(merged.species)} species '
+              f'and {len(merged.locations)} locations to {args.incidence}')
+
+    if previous:
+        previous.save()
+        print(f"Incremental run: {cache_counts['manifest']} unchanged "
+              f"treatments reused, {len(pdfs)-cache_counts['manifest']} "
+              "extracted")
+
+    if cache:
+        print(f"Text cache: {cache_counts['hit']} hits, "
+              f"{cache_counts['miss']} misses")
+
+    if args.profile:
+        dumps = profiling.write_report(args.profile, profiles,
+                                       cprofile=args.cprofile)
+        print(f'Wrote the profile of each treatment to {args.profile}')
+        for dump in dumps:
+            print(f'Wrote cProfile stats to {dump}')
 
-        # If the extracting algorithm couldn't find locations, keep track of
-        # the error messages
-        results = extract_from(treatment)
-        if results['error']:
-            success = False
-            error += sep+results['error']
-            log_error += sep+results['verbose-error']
+    if success:
+        print('Data was extracted successfully')
+    else:
+        print('\n'.join(error))
+        print('An error occured when extracting the flora data. See ' \
+              'errors.jsonl for more details.')
 
-        # If the user specified a single output file, compile all the
-        # lines into a single string and write to a file later
-        if args.o:
-            locations += sep+results['locations']
-            classifiers += sep+results['classifiers']
+class OutputDialect(csv.excel):
+    """The csv format of the output files.
 
-        # If the user didn't specify a single output file write the files
-        # for each treatment as we go
-        else:
-            with open(fn+'.csv', 'w') as f:
-                f.write(results['locations'])
-            with open(fn+'-classifiers.csv', 'w') as f:
-                f.write(results['classifiers'])
+    Rows are written as "<species name>, <value>" so the space after the comma
+    is skipped when the files are read back with this dialect.
+    """
+    lineterminator = '\n'
+    skipinitialspace = True
+
+def write_rows(f, rows):
+    """Write (species name, value) rows to the csv file f."""
+    writer = csv.writer(f, dialect=OutputDialect)
+    writer.writerows((name, ' '+value) for name, value in rows)
 
-        sep = '\n'
+def csv_name(treatment):
+    """Return the name of the csv files of a treatment, without ".csv".
 
-    # if the user specified a single output file, now is when we write it
-    if args.o:
-        # locations file
-        fn = args.o
+    The csv files are named after the pdf, in the same directory. If the
+    treatment isn't a pdf file None is returned.
+    """
+    match = re.match(r'([\w\.]+)\.pdf', os.path.basename(treatment))
+    if not match:
+        return None
+    return os.path.join(os.path.dirname(treatment), match[1])
 
-        # classifiers file
-        idfn = ''
+def output_names(fn):
+    """Return the locations and classifiers file names of a single output file.
 
-        # The user may have alread include the file extension
-        try:
-            i = fn.index('.csv')
-            idfn = fn[:i]+'-classifiers'+fn[i:]
+    Parameters:
+        fn - the output file name the user specified
+    """
+    # The user may have alread include the file extension
+    try:
+        i = fn.index('.csv')
+        return fn, fn[:i]+'-classifiers'+fn[i:]
 
-        # If the user didn't include the file extension, add it
-        except ValueError:
-            fn += '.csv'
-            idfn = fn+'-classifiers.csv'
+    # If the user didn't include the file extension, add it
+    except ValueError:
+        fn += '.csv'
+        return fn, fn+'-classifiers.csv'
 
-        with open(fn, 'w') as f:
-            f.write(locations)
-        with open(idfn, 'w') as f:
-            f.write(classifiers)
+class OutputSink:
+    """Where the data extracted from each treatment is written.
 
-    if success:
-        print('Data was extracted successfully')
+    Parameters:
+        fn - a single output file to write the rows of every treatment to,
+             along with its "-classifiers" file (defaults to None, meaning
+             each treatment is written to its own pair of csv files)
+        sqlite - the file name of an SQLite database to store every treatment
+                 in, in which case csv files are only written if fn is given
+                 (defaults to None)
+        append - whether to add to the csv files and errors.jsonl rather than
+                 overwrite them (defaults to False)
+        sizes - whether to keep track of how many bytes of each treatment are
+                written to the single output files and errors.jsonl, in
+                self.sizes (defaults to False)
+
+    Use it as a context manager to close the files when done.
+    """
+    def __init__(self, fn=None, sqlite=None, append=False, sizes=False):
+        self.mode = 'a' if append else 'w'
+        self.files = contextlib.ExitStack()
+        self.locations = self.classifiers = self.db = None
+
+        # The number of bytes of each treatment in the locations file, the
+        # classifiers file and errors.jsonl, if they're kept track of
+        self.sizes = [] if sizes else None
+
+        # If the user specified a single output file, every treatment is
+        # written to the same pair of files
+        if fn:
+            fn, idfn = output_names(fn)
+            self.locations = self.files.enter_context(
+                    open(fn, self.mode, newline=''))
+            self.classifiers = self.files.enter_context(
+                    open(idfn, self.mode, newline=''))
+
+        if sqlite:
+            # sqlite3 takes a while to import, so only import it when needed
+            from . import database
+            self.db = self.files.enter_context(
+                    database.SpeciesDatabase(sqlite))
+
+        # errors.jsonl is only written when something goes wrong, so it isn't
+        # opened until the first error
+        self.log_error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.files.close()
+        return False
+
+    def write(self, treatment, fn, results):
+        """Write what was extracted from a treatment as soon as it's ready.
+
+        Parameters:
+            treatment - the file name of the treatment
+            fn - the name of the treatment's own csv files, without ".csv"
+            results - the results of extract_from for the treatment
+        """
+        if self.sizes is not None:
+            before = self.tell()
+
+        # Write a JSON line for each error as soon as the treatment is done,
+        # so they can be followed (and aggregated) while the run goes on
+        if results['errors']:
+            if not self.log_error:
+                self.log_error = self.files.enter_context(
+                        open('errors.jsonl', self.mode, encoding='utf8'))
+            for record in results['errors']:
+                self.log_error.write(json.dumps({'treatment': str(treatment),
+                                                 **record})+'\n')
+            self.log_error.flush()
+
+        if self.db:
+            self.db.add_treatment(treatment, results['records'])
+
+        # If the user specified a single output file, add this treatment's
+        # rows to it
+        if self.locations:
+            write_rows(self.locations, results['locations'])
+            write_rows(self.classifiers, results['classifiers'])
+            self.locations.flush()
+            self.classifiers.flush()
+
+        # If the user didn't specify a single output file write the files for
+        # each treatment as we go
+        elif not self.db:
+            with open(fn+'.csv', 'w', newline='') as f:
+                write_rows(f, results['locations'])
+            with open(fn+'-classifiers.csv', 'w', newline='') as f:
+                write_rows(f, results['classifiers'])
+
+        if self.sizes is not None:
+            self.sizes.append([after-size for after, size
+                               in zip(self.tell(), before)])
+
+    def tell(self):
+        """Return how many bytes have been written to the locations file,
+        the classifiers file and errors.jsonl (0 for each that isn't open)."""
+        return [f.tell() if f else 0
+                for f in (self.locations, self.classifiers, self.log_error)]
+
+def location_rows(records):
+    """Generate the (species name, location) rows of SpeciesRecords."""
+    for record in records:
+        name = record.name
+        for location in record.locations:
+            yield name, location
+
+def classifier_rows(records):
+    """Generate the (species name, classifiers) rows of SpeciesRecords."""
+    for record in records:
+        yield record.name, record.classifiers
+
+def pdfs_in(directory, recursive=False):
+    """Generate the file names of the pdf files in directory.
+
+    Parameters:
+        directory - the directory to look in (an empty string for the current
+                    directory)
+        recursive - whether to look in every subdirectory too (defaults to
+                    False)
+
+    The file names are generated in sorted order, so that they're the same on
+    every file system. The files in subdirectories are sorted along with the
+    rest rather than after them, so the order only depends on the names.
+    """
+    if not recursive:
+        for fn in sorted(os.listdir(directory or '.')):
+            if '.pdf' in fn:
+                yield os.path.join(directory, fn)
+        return
+
+    found = []
+    for root, dirs, files in os.walk(directory or '.'):
+        found.extend(os.path.normpath(os.path.join(root, fn))
+                     for fn in files if '.pdf' in fn)
+    yield from sorted(found)
+
+class SpeciesRecord(namedtuple('SpeciesRecord', ['genus', 'species', 'rank',
+                                                 'infraspecies', 'classifiers',
+                                                 'locations', 'start', 'end'])):
+    """The data extracted for a species or subspecies.
+
+    Fields:
+        genus - the genus name
+        species - the species name
+        rank - "subsp." or "var." for an infraspecific taxon, otherwise an
+               empty string
+        infraspecies - the subspecies or variety name (or an empty string)
+        classifiers - the classifiers of the species as they appear in the
+                      treatment (e.g. "F W"), or an empty string
+        locations - a tuple of the locations the species appears in
+        start, end - the offsets of the species block in the treatment text
+    """
+    __slots__ = ()
+
+    @property
+    def name(self):
+        """The full name of the species, as written to the output files."""
+        if self.infraspecies:
+            return f'{self.genus} {self.species} {self.infraspecies}'
+        return f'{self.genus} {self.species}'
+
+    @property
+    def flags(self):
+        """The set of classifier letters of the species."""
+        return frozenset(self.classifiers.replace(' ', ''))
+
+def species_records(text, profiler=None, partitions=None):
+    """Generate a SpeciesRecord for each species* in a treatment's text.
+
+    *Note that this includes subspecies.
+
+    Parameters:
+        text - the treatment text
+        profiler - the StageProfiler to record the parsing stages with
+                   (defaults to None)
+        partitions - the PartitionCache to look for the partition of the
+                     text in, and to add it to if it isn't there (defaults
+                     to None)
+
+    Each record is generated as soon as its block has been parsed, so nothing
+    is kept around for the whole treatment. When partitions are cached, the
+    whole treatment is partitioned before the first block is parsed.
+
+    Raises a Value error if the genus isn't found in the treatment.
+    """
+    if not profiler:
+        profiler = profiling.StageProfiler(enabled=False)
+
+    partition = None
+    if partitions:
+        key = partitions.key(text, partitioner_version)
+        partition = partitions.get(key)
+
+    if partition:
+        genus, spans = partition['genus'], partition['spans']
     else:
-        print(error)
-        with open('error.log', 'wb') as f:
-            f.write(log_error.encode('utf8'))
-        print('An error occured when extracting the flora data. See ' \
-              'error.log for more details.')
+        genus = genus_in(text)
+        if not genus:
+            raise ValueError("No genus was found!")
+
+        # Blocks are searched in place, so the text isn't copied
+        spans = profiler.timed('partition', partition_spans(text, genus))
+
+        # Treatments that can't be partitioned raise an error before they're
+        # cached, so they're partitioned again (and raise again) every time
+        if partitions:
+            spans = list(spans)
+            partitions.put(key, {'genus': genus, 'spans': spans})
 
-def extract_from(treatment):
+    for start, end, name, rank in spans:
+        with profiler.stage('analyze_block'):
+            ids, locs = analyze_block(text, start, end)
+
+        genus, species, *infraspecies = name.split(' ')
+        yield SpeciesRecord(genus, species, rank, ''.join(infraspecies), ids,
+                            locs, start, end)
+
+def extract_records(treatment, cache=None, backend=backends.default_backend,
+                    stream=False):
+    """Generate a SpeciesRecord for each species* in the genus treatment.
+
+    *Note that this includes subspecies.
+
+    Parameters:
+        treatment - a pdf file name of the genus treatment
+        cache - the TextCache to load the treatment text from (defaults to
+                None)
+        backend - the name of the pdf text backend (defaults to
+                  backends.default_backend)
+        stream - whether to stop reading the pdf at the references (defaults
+                 to False)
+    """
+    text = load_treatment(treatment, cache=cache, backend=backend,
+                          stream=stream)
+    yield from species_records(text)
+
+def extract_all(treatments, jobs=1, cache=None,
+                backend=backends.default_backend, stream=False,
+                profile=False, cprofile=False, conversions=0, budget=None,
+                partitions=None, excerpt=200):
+    """Generate the results of extract_from for each treatment.
+
+    Parameters:
+        treatments - a list of pdf file names of genus treatments
+        jobs - the number of worker processes to extract with (defaults to 1)
+        cache - the TextCache to load treatment text from (defaults to None)
+        backend - the name of the pdf text backend (defaults to
+                  backends.default_backend)
+        stream - whether to stop reading each pdf at the references (defaults
+                 to False)
+        profile, cprofile - whether to profile each treatment, as described
+                            by extract_from (both default to False)
+        conversions - if not 0, how many pdfs to convert at a time in this
+                      process with the asyncio pipeline of florana.pipeline,
+                      instead of using worker processes (defaults to 0)
+        budget - how many seconds parsing each treatment may take, as
+                 described by extract_from (defaults to None)
+        partitions - the PartitionCache to reuse the partition of each
+                     treatment from (defaults to None)
+        excerpt - how much of the text of each error to keep, as described by
+                  extract_from (defaults to 200)
+
+    The results are always generated in the same order as the treatments, so
+    the output doesn't depend on which worker finishes first. When jobs is 1
+    the treatments are extracted one after another in this process.
+    """
+    if conversions:
+        # asyncio takes a while to import, so only import it when needed
+        from . import pipeline
+        yield from pipeline.extract_pipelined(treatments, conversions,
+                                              cache=cache, backend=backend,
+                                              stream=stream, budget=budget,
+                                              partitions=partitions,
+                                              excerpt=excerpt)
+        return
+
+    extract = functools.partial(extract_from, cache=cache, backend=backend,
+                                stream=stream, profile=profile,
+                                cprofile=cprofile, budget=budget,
+                                partitions=partitions, excerpt=excerpt)
+    if jobs == 1 or len(treatments) < 2:
+        yield from map(extract, treatments)
+        return
+
+    # Each treatment is a unit of work on its own, so hand them out one at a
+    # time: treatments vary a lot in size and bigger chunks would leave workers
+    # idle at the end of the run
+    # The process pool is only imported when it's needed since it takes a
+    # while to import
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=warm_up) as executor:
+        yield from executor.map(extract, treatments, chunksize=1)
+
+def warm_up():
+    """Load the gazetteer and location key before the first treatment.
+
+    Worker processes are started with this so that they're ready to extract
+    as soon as treatments are handed to them.
+    """
+    gazetteer.location_trie()
+    load_key()
+
+def extract_from(treatment, cache=None, backend=backends.default_backend,
+                 stream=False, profile=False, cprofile=False, budget=None,
+                 partitions=None, excerpt=200):
     """Extract the data from the genus treatment.
 
     Parameters:
         treatment - a pdf file name of the genus treatment.
-        data_type - "locations" or "classifiers"
+        cache - the TextCache to load the treatment text from (defaults to
+                None, meaning the text is always extracted from the pdf)
+        backend - the name of the pdf text backend to extract the text with
+                  (defaults to backends.default_backend)
+        stream - whether to read the pdf one page at a time and stop at the
+                 page where the references start (defaults to False)
+        profile - whether to record the time and memory spent by each stage
+                  of the extraction (defaults to False)
+        cprofile - whether to also run cProfile while profiling (defaults to
+                   False)
+
+        budget - how many seconds parsing the treatment may take; parsing
+                 stops after the first species that goes over it (defaults to
+                 None, meaning there's no limit)
+        partitions - the PartitionCache to reuse the partition of the
+                     treatment text from (defaults to None, meaning the text
+                     is always partitioned)
+        excerpt - how many characters of the text of each error to keep in
+                  its record (defaults to 200; None keeps the whole block)
 
     Returns a dict of results with the following format
 
-        "locations" - a string of species names and locations they appear in
+        "locations" - a list of (species name, location) rows for each
+                      location a species appears in
+
+        "classifiers" - a list of (species name, classifiers) rows for each
+                        species
+
+        "records" - a list of the SpeciesRecord of each species
+
+        "error" - a list of brief error messages stating which species the
+                  algorithm couldn't find locations for
 
-        "classifiers" - a string of species names and their classifiers
+        "errors" - a list of the record of each error, as returned by
+                   error_record, with an excerpt of the block of text the
+                   algorithm searched in for the locations
 
-        "error" - a brief error message stating which species the algorithm
-                  couldn't find locations for
+        "cache" - "hit" if the treatment text was found in the cache, "miss"
+                  if it wasn't and an empty string if there's no cache
 
-        "verbose-error" - an error message stating which species the algorithm
-                          couldn't find locations for as well as the block of
-                          text that the algorithm searched in for the locations
+        "timeout" - whether parsing went over the budget, in which case only
+                    the species parsed before that are in the results and the
+                    timeout is one of the errors
+
+        "profile" - if profiling, the StageProfiler report of the treatment
+
+        "cprofile" - if profiling with cProfile, its stats for the treatment
 
     Raises a Value error if the genus isn't found in the treatment.
     """
-    text = load_treatment(treatment)
-    genus = genus_in(text)
-    if not genus:
-        raise ValueError("No genus was found!")
+    profiler = profiling.StageProfiler(enabled=profile, cprofile=cprofile)
+
+    with profiler:
+        hits = cache.hits if cache else 0
+        with profiler.stage('load_treatment'):
+            text = load_treatment(treatment, cache=cache, backend=backend,
+                                  stream=stream)
+        data = results_from(text, profiler=profiler, budget=budget,
+                            partitions=partitions, excerpt=excerpt)
+        if cache:
+            data['cache'] = 'hit' if cache.hits > hits else 'miss'
+
+    if profile:
+        data['profile'] = profiler.report()
+        data['cprofile'] = profiler.stats()
+    return data
 
-    data = {'locations': '', 'classifiers': '',
-            'error': '', 'verbose-error': ''}
-    locsep = ''
-    errsep = ''
-    idsep = ''
+def error_record(kind, message, text, start, end, species='', excerpt=200):
+    """Return the record of an error in the text of a treatment.
 
-    for block, name in partition(text, genus):
+    Parameters:
+        kind - what went wrong: "no-locations", "timeout", "partition",
+               "load" or "skipped"
+        message - the brief error message
+        text - the treatment text
+        start, end - the offsets of the text the error is about
+        species - the name of the species the error is about, if any
+        excerpt - how many characters of the text to keep, from start
+                  (defaults to 200; None keeps all of it)
+
+    The record is a dict with these keys as well as "excerpt", the text that
+    was kept, and "truncated", whether it's shorter than the whole text.
+    Only the excerpt is copied, so errors in long blocks stay small.
+    """
+    stop = end if excerpt is None else min(end, start+excerpt)
+    return {'species': species, 'kind': kind, 'message': message,
+            'start': start, 'end': end, 'excerpt': text[start:stop],
+            'truncated': stop < end}
 
-        ids = ids_in(block)
-        data['classifiers'] += f'{idsep}{name}, {ids}'
-        idsep = '\n'
+def results_from(text, profiler=None, budget=None, partitions=None,
+                 excerpt=200):
+    """Return the results of extract_from for the text of a treatment.
 
-        locs = '\n'.join(f'{name}, {loc}' for loc in locs_in(block))
-        if not locs:
-            data['error'] += f"{errsep}Couldn't find locations for {name}"
-            data['verbose-error'] += f"{errsep}Couldn't find locations for " \
-                                     f"{name} in:\n\n{block}\n"
-            errsep = '\n'
-        else:
-            data['locations'] += locsep+locs
-            locsep = '\n'
+    Parameters:
+        text - the treatment text
+        profiler - the StageProfiler to record the parsing stages with
+                   (defaults to None)
+        budget - how many seconds parsing the text may take, as described by
+                 extract_from (defaults to None, meaning there's no limit)
+        partitions - the PartitionCache passed on to species_records
+                     (defaults to None)
+        excerpt - how much of the text of each error to keep, as described by
+                  extract_from (defaults to 200)
+
+    "cache" is an empty string in the results and they aren't profiled.
 
+    Raises a Value error if the genus isn't found in the treatment.
+    """
+    data = {'locations': [], 'classifiers': [], 'records': [],
+            'error': [], 'errors': [], 'cache': '', 'timeout': False}
+
+    deadline = time.monotonic()+budget if budget else None
+    for record in species_records(text, profiler=profiler,
+                                  partitions=partitions):
+        data['records'].append(record)
+        if not record.locations:
+            message = f"Couldn't find locations for {record.name}"
+            data['error'].append(message)
+            data['errors'].append(error_record('no-locations', message, text,
+                                               record.start, record.end,
+                                               record.name, excerpt))
+
+        # The budget is checked after each species, so a treatment that can't
+        # be parsed in time records what it has so far (along with its
+        # errors) and gives up on the rest instead of holding up the other
+        # treatments
+        if deadline and time.monotonic() > deadline:
+            data['timeout'] = True
+            message = f'Gave up after {budget:g} seconds at "{record.name}": '\
+                      f'the rest of the treatment was skipped'
+            data['error'].append(message)
+            data['errors'].append(error_record('timeout', message, text,
+                                               record.end, len(text),
+                                               record.name, excerpt))
+            break
+
+    data['locations'] = list(location_rows(data['records']))
+    data['classifiers'] = list(classifier_rows(data['records']))
     return data
 
-def load_treatment(fn, encoding='utf-8'):
-    """ Load the treatment using textract
+def load_treatment(fn, encoding='utf-8', cache=None,
+                   backend=backends.default_backend, stream=False):
+    """ Load the treatment text from its pdf
 
     Parameters:
 
         fn - the file name of the treatment
         encoding - the encoding of the file (defaults to utf-8)
+        cache - the TextCache to look for the text in before extracting it
+                (defaults to None)
+        backend - the name of the pdf text backend to extract with (defaults
+                  to backends.default_backend)
+        stream - whether to read the pdf one page at a time and stop at the
+                 page where the references start (defaults to False)
     """
+    extractor = backends.get_backend(backend)
+
     path = Path.joinpath(Path.cwd(), fn)
-    return textract.process(str(path), encoding=encoding).decode(encoding)
+    def extract_text():
+        if stream:
+            pages = extractor.pages(path, encoding=encoding)
+            return read_until_references(pages)
+        return extractor.text(path, encoding=encoding)
+
+    name = cache_name(backend, stream)
+
+    if not cache:
+        return extract_text()
+
+    key = cache.key(path, encoding, name)
+    text = cache.get(key)
+    if text is None:
+        text = extract_text()
+        cache.put(key, text)
+    return text
+
+def cache_name(backend, stream=False):
+    """Return the name text extracted by backend is cached under.
+
+    Parameters:
+        backend - the name of the pdf text backend
+        stream - whether the text is read until the references (defaults to
+                 False)
+    """
+    # Streamed text is cut short, so it's cached separately from whole text
+    return backend+(':until-references' if stream else '')
+
+# Everything after this heading is irrelevant for this program (see subgroups
+# and species_spans)
+references_heading = "OTHER REFERENCES"
+
+def read_until_references(pages):
+    """Return the text of pages up to the end of the page the references
+    start on.
+
+    Parameters:
+        pages - an iterator of the text of each page of a treatment
+
+    The rest of the pages aren't read, so the pdf they come from isn't
+    extracted any further. Since the references section is cut off after its
+    first page, the treatment is partitioned the same way as the whole text.
+    """
+    read = []
+    tail = ''
+    for page in pages:
+        read.append(page)
+
+        # The heading could be split between pages
+        if references_heading in tail+page:
+            break
+        tail = (tail+page)[-len(references_heading):]
+
+    # Stop extracting the rest of the pdf
+    if hasattr(pages, 'close'):
+        pages.close()
+    return ''.join(read)
 
 # regex patterns
 
+# The pattern builders below cache the patterns they compile, since the same
+# patterns are built for every subgroup and species of a treatment and for
+# every treatment of the same genus. This is how many patterns each builder
+# keeps (least recently used patterns are dropped first).
+pattern_cache_size = 512
+
+def pattern_cache_info():
+    """Return the cache statistics of each pattern builder.
+
+    The statistics are returned as a dict mapping the name of each builder to
+    its functools cache info: the number of hits, misses and cached patterns.
+    """
+    return {builder.__name__: builder.cache_info()
+            for builder in (build_key_pattern, compile_intro_pattern,
+                            build_index_pattern)}
+
 # --- Genus pattern ---
 #
 # Assumes that the file contains the genus name in the following format:
@@ -220,17 +969,35 @@ def genus_in(treatment):
     genus = genus_match[1]
     return genus[0]+(genus[1:].lower())
 
+# The version of the partitioner, which cached partitions are keyed by (see
+# cache.PartitionCache). Change it whenever a change to partition_spans, or to
+# anything it uses, could partition a treatment differently.
+partitioner_version = 1
+
 def partition(treatment, genus):
     """Yield the block and name in treatment associated with each species*.
 
     *Note that this includes subspecies.
 
     treatment - the treatment text (a string)
-    species - a list of species names
+    genus - the genus of the treatment
+    """
+    for start, end, name, _ in partition_spans(treatment, genus):
+        yield treatment[start:end], name
+
+def partition_spans(treatment, genus):
+    """Yield the start, end, name and rank of each species* block in treatment.
+
+    *Note that this includes subspecies. The rank of a subspecies is "subsp."
+    or "var." and the rank of a species is an empty string.
+
+    treatment - the treatment text (a string)
+    genus - the genus of the treatment
     """
     # Find all the species names in the treatment and reorder them in the order
     # they appear in the text
-    name_gens = [keys_in(subgroup, genus) for subgroup in subgroups(treatment)]
+    name_gens = [keys_in(treatment, genus, start, end)
+                 for start, end in subgroup_spans(treatment)]
     names = sorted(itertools.chain(*name_gens),
                    key=lambda s: int(s.split('.')[0]))
 
@@ -239,22 +1006,35 @@ def partition(treatment, genus):
     names = (' '.join(name.split(' ')[1:3]).strip() for name in names)
     names = OrderedDict.fromkeys(names).keys()
 
-    for block, name in species_blocks(treatment, names):
+    # Find every species and subspecies introduction in one pass over the text
+    index = IntroIndex(treatment, genus)
+
+    for start, end, name in species_spans(treatment, names, index=index):
         # each species block may have subspecies
         has_subspecies = False
-        for sub_block, sub_name in subspecies_blocks(block, name):
+        for subspecies in subspecies_spans(index, name, start, end):
             has_subspecies = True
-            yield sub_block, sub_name
+            yield subspecies
 
         if not has_subspecies:
-            yield block, name
+            yield start, end, name, ''
 
 def subgroups(treatment):
     """Generate each subgroup block in order."""
+    for start, end in subgroup_spans(treatment):
+        yield treatment[start:end]
+
+# Once this is encountered, all info is irrelevant for this program
+other_references_pattern = re.compile('other reference', re.IGNORECASE)
+
+def subgroup_spans(treatment):
+    """Generate the start and end of each subgroup block in order."""
     # Find all occurences of genus headers
     headers = list(genus_pattern.finditer(treatment))
 
-    i, j = 0, 0
+    # A header can start the text (as it does in each genus of a volume), so
+    # no header has been found until i is at least 0
+    i, j = -1, -1
     # If there are subgroups, the first header is for the entire treatement and
     # there's no species key before the header for the first subgroup, so take
     # the first header out of the list
@@ -266,38 +1046,42 @@ def subgroups(treatment):
         # the previous match
         j = next_header.start()
 
-        # If the block starts at index 0, then we haven't even reached the first
-        # subgroup block, so don't yield yet
-        if i > 0:
-            yield treatment[i:j]
+        # If no header has been found yet, then we haven't even reached the
+        # first subgroup block, so don't yield yet
+        if i >= 0:
+            yield i, j
 
         # Update i to the start of the current header: on the next iteration
         # it will become the start of the previous header and j will be the
         # start of the current header.
         i = j
 
-    # Once this is encountered, all info is irrelevant for this program
-    try:
-        k = treatment.lower().index("other reference")
-    except:
-        k = -1
-    if i > 0:
-        yield treatment[j:k]
+    # Search for the references without making a lowercase copy of the text.
+    # Without them the block ends just before the last character of the text.
+    references = other_references_pattern.search(treatment)
+    k = references.start() if references else len(treatment)-1
+    if i >= 0:
+        # The references may come before the last header
+        yield j, max(j, k)
 
     # If there were no matches, then a genus couldn't be found
     else:
         raise ValueError("No genus was found!")
 
-def keys_in(subgroup, genus):
+def keys_in(subgroup, genus, pos=0, endpos=None):
     """Generate all species names from the species key in a subgroup block.
 
     subgroup - the subgroup block containing the species
     genus - of the species
+    pos, endpos - the span of the subgroup block if subgroup is the whole
+                  treatment text (defaults to all of subgroup)
     """
+    if endpos is None:
+        endpos = len(subgroup)
     key_pattern = build_key_pattern(genus)
 
     has_species_key = False
-    for match in key_pattern.finditer(subgroup):
+    for match in key_pattern.finditer(subgroup, pos, endpos):
         has_species_key = True
         yield match[0]
 
@@ -307,7 +1091,7 @@ def keys_in(subgroup, genus):
         # Compile the intro pattern without knowing what the species is. Since
         # there's only one species this is fine.
         intro_pattern = build_intro_pattern(genus)
-        intro = intro_pattern.search(subgroup)
+        intro = intro_pattern.search(subgroup, pos, endpos)
 
         if not intro:
             raise ValueError('No species found!')
@@ -323,31 +1107,43 @@ def species_blocks(treatment, names):
     treatment - the treatment text
     names - an ordered list of all species names that appear in the treatment
     """
+    for start, end, name in species_spans(treatment, names):
+        yield treatment[start:end], name
+
+def species_spans(treatment, names, index=None):
+    """Generate the start, end and name of each species block* in treatment.
+
+    *Note that this includes all subspecies if any.
+
+    treatment - the treatment text
+    names - an ordered list of all species names that appear in the treatment
+    index - the IntroIndex of the treatment (built if not given)
+    """
     error=''
     i, j = 0, 0
 
     # Split the whole text into blocks based on the introduction to each subsp.
     for next_name in names:
-        # split the name up into its individual parts in order to pass once
-        # again into the intro_pattern builder, this time compiling to look
-        # for a specific species.
+        # split the name up into its individual parts in order to look up
+        # where this specific species is introduced
         if len(next_name.split(' ')) > 2:
             if error:
                 error += '\n'
             error += f'"{next_name}" is too long: expected 2 words!'
             continue
         genus, species = next_name.split(' ')
-        intro_pattern = build_intro_pattern(genus, species=species)
-        intro = intro_pattern.search(treatment)
+        if not index or index.genus != genus:
+            index = IntroIndex(treatment, genus)
+        intro = index.species_start(species)
 
         # Produce error message if species introduction couldn't be found
-        if not intro:
+        if intro is None:
             if error:
                 error += '\n'
             error += f'Could not find species introduction for "{next_name}"'
             continue
 
-        j = intro.start()
+        j = intro
 
         # If i > j, then something went wrong when we reordered the search
         # results.
@@ -360,18 +1156,19 @@ def species_blocks(treatment, names):
         # If the block starts at index 0, then we haven't even reached the first
         # species block, so don't yield yet
         elif i > 0:
-            yield treatment[i:j], name
+            yield i, j, name
 
         name = next_name
         i = j
 
-    # Finally yield the "current" match (the last match).
+    # Finally yield the "current" match (the last match). Without a references
+    # section the block ends just before the last character of the text.
     try:
         k = treatment.index("OTHER REFERENCES")
     except ValueError:
-        k = -1
+        k = len(treatment)-1
     if i > 0:
-        yield treatment[j:k], name
+        yield j, k, name
 
     if error:
         error += "\nErrors occured while partitioning species blocks!"
@@ -383,22 +1180,29 @@ def subspecies_blocks(block, species):
     block - the species block to look in
     species - the species name of the form "<genus> <species>"
     """
+    index = IntroIndex(block, species.split(' ')[0])
+    for start, end, name, _ in subspecies_spans(index, species, 0, len(block)):
+        yield block[start:end], name
+
+def subspecies_spans(index, species, start, end):
+    """Generate the start, end, name and rank of each subspecies block, if any.
+
+    index - the IntroIndex of the text containing the species block
+    species - the species name of the form "<genus> <species>"
+    start, end - the offsets of the species block in the indexed text
+    """
     if len(species.split(' ')) > 2:
         raise ValueError(f'"{species}" is too long: expected 2 words!')
     genus, species = species.split(' ')
 
-    # Build the intro pattern to specifically look for subspecies
-    intro_pattern = build_intro_pattern(genus, species=species,
-                                        subspecies=r'[a-z]+')
-
     error = ''
     i, j = 0, 0
-    name = ''
-    # go through each subspecies introduction match
-    for intro in intro_pattern.finditer(block):
-
-        # Start
-        j = intro.start()
+    name = rank = ''
+    # go through each subspecies introduction in the block
+    for intro, _, next_rank, subspecies in index.subspecies_intros(species,
+                                                                   start, end):
+        # Start (relative to the beginning of the block)
+        j = intro-start
         # Only yield the previous match when we've actually found it
         if i > 0:
             if i > j:
@@ -406,24 +1210,106 @@ def subspecies_blocks(block, species):
                     error += '\n'
                 error += f'When searching in "{name}" block: Indices ({i}, {j}'\
                          ') are out of order!'
-            yield block[i:j], name
+            yield start+i, start+j, name, rank
 
         # The name should include the entire species, including the subspecies
-        # The intro pattern should have matched all of these.
-        name = ' '.join(intro.groups())
+        name = f'{genus} {species} {subspecies}'
+        rank = next_rank
         i = j
 
-    # It's possible that there are no subspecies. The intro pattern wouldn't
-    # have found anything and i would have never been incremented. If this is
-    # the case we don't want to yield anything, otherwise yield the rest of
-    # subspecies block until the end of the species block
+    # It's possible that there are no subspecies. The index wouldn't have found
+    # anything and i would have never been incremented. If this is the case we
+    # don't want to yield anything, otherwise yield the rest of subspecies
+    # block until (just before) the end of the species block
     if i > 0:
-        yield block[j:-1], name
+        yield start+j, end-1, name, rank
 
     if error:
         error += "\nErrors occured when partitioning the treatment"
         raise ValueError(error)
 
+# --- Species and subspecies introductions ---
+#
+# Both are introduced at the beginning of a line in the same way that
+# build_intro_pattern describes: species are numbered "n." and subspecies
+# "na.", followed by the genus and species name. Rather than searching the
+# text for every species name, find every introduction once and look the
+# species up afterwards.
+#
+# The pattern has two subgroups:
+#   1. The alphabetical numbering of a subspecies (empty for a species)
+#   2. The species name (possibly empty)
+@functools.lru_cache(maxsize=pattern_cache_size)
+def build_index_pattern(genus):
+    """Build a regex pattern for any species or subspecies introduction."""
+    return re.compile(r'^\d+([a-z]*)\.[ ]*'+genus+r' ((?:x\\)?[a-z\-]*)',
+                      flags=re.MULTILINE)
+
+# The subspecies or variety named after the species in its introduction
+subspecies_name_pattern = re.compile(r'(subsp|var)\.\s*([a-z]+)')
+
+class IntroIndex:
+    """The offsets of every species and subspecies introduction in a text.
+
+    Parameters:
+        text - the text to index (a treatment or a species block)
+        genus - the genus of the species introduced in the text
+
+    The text is scanned once when the index is built. Looking up a species
+    gives the same offsets as searching the text with the matching
+    build_intro_pattern, without rescanning the text for every species.
+    """
+    def __init__(self, text, genus):
+        self.text = text
+        self.genus = genus
+
+        # Maps every prefix of a species name to the first introduction that
+        # starts with it, since the intro pattern doesn't need the species
+        # name to end where the introduced name does
+        self.species = {}
+
+        # The (start, species name start, species name) of each subspecies
+        # introduction in order, along with their starts for bisecting
+        self.subspecies = []
+        self.subspecies_starts = []
+
+        for intro in build_index_pattern(genus).finditer(text):
+            numbering, name = intro.groups()
+            if numbering:
+                self.subspecies.append((intro.start(), intro.start(2), name))
+                self.subspecies_starts.append(intro.start())
+                continue
+            for k in range(1, len(name)+1):
+                self.species.setdefault(name[:k], intro.start())
+
+    def species_start(self, species):
+        """Return the offset of the species introduction or None."""
+        return self.species.get(species)
+
+    def subspecies_intros(self, species, start, end):
+        """Generate each subspecies introduction of species in text[start:end].
+
+        Generates the start and end offsets of the introduction along with
+        the rank ("subsp." or "var.") and the subspecies name, just as
+        build_intro_pattern would match them.
+        """
+        pos = start
+        first = bisect.bisect_left(self.subspecies_starts, start)
+        for intro, name_start, name in self.subspecies[first:]:
+            species_end = name_start+len(species)
+            if species_end > end:
+                break
+            if intro < pos or not name.startswith(species):
+                continue
+
+            # The subspecies name is the first one after the species name
+            match = subspecies_name_pattern.search(self.text, species_end, end)
+            if not match:
+                break
+            yield intro, match.end(), match[1]+'.', match[2]
+            pos = match.end()
+
+@functools.lru_cache(maxsize=pattern_cache_size)
 def build_key_pattern(genus):
     """Build a regex pattern for the genus key
 
@@ -463,6 +1349,18 @@ def build_intro_pattern(genus, species=r'(?:x\\)?[a-z\-]+', subspecies=''):
     1 - the genus name
     2 - the species name
     3 - the subspecies name (if specified)
+
+    The compiled pattern is cached, so building the same pattern again is
+    cheap.
+    """
+    return compile_intro_pattern(genus, species, subspecies)
+
+@functools.lru_cache(maxsize=pattern_cache_size)
+def compile_intro_pattern(genus, species, subspecies):
+    """Compile the pattern described by build_intro_pattern.
+
+    All three parameters are required so that the pattern is cached under the
+    same key no matter how build_intro_pattern was called.
     """
     # --- Species Introduction ---
     #
@@ -492,6 +1390,10 @@ def build_intro_pattern(genus, species=r'(?:x\\)?[a-z\-]+', subspecies=''):
     #
     # i.e. the '{arbitrary text} [(subsp|var). name] {arbitrary text}' part of
     # the introduction is now matched
+    #
+    # The ".*?" rescans the rest of the text from every introduction that
+    # isn't followed by the subspecies, so extraction finds subspecies with
+    # IntroIndex.subspecies_intros instead, which never rescans the text
     if subspecies:
         pattern += r'.*?(?:subsp|var)\.\s*('+subspecies+')'
 
@@ -508,24 +1410,26 @@ def build_intro_pattern(genus, species=r'(?:x\\)?[a-z\-]+', subspecies=''):
 # It's possible that there are no classifiers
 
 id_pattern = re.compile(r'([CEFIW ]+)\s*$', re.MULTILINE)
-def ids_in(block):
+def ids_in(block, pos=0, endpos=None):
     """Finds the classifiers for a species.
 
     Parameters:
         block - a block of text (a string) with its scope limited to a single
                 species or subspecies
+        pos, endpos - the span of the block if block is the whole treatment
+                      text (defaults to all of block)
 
     Returns an empty string if there are no classifiers for this species.
     """
-    error = ''
-    sep = ''
-    for line in block.split('\n'):
-        matches = id_pattern.findall(line)
+    if endpos is None:
+        endpos = len(block)
 
-        # If matches were found return the last match (the pattern is meant to
-        # be searched from the end of the line)
-        if matches:
-            return matches[-1].strip()
+    # The classifiers can't span lines, so the first match is on the first
+    # line that has classifiers (the pattern is meant to be searched from the
+    # end of the line)
+    match = id_pattern.search(block, pos, endpos)
+    if match:
+        return match[1].strip()
 
     # if no matches found, there are no classifiers; return an empty string
     return ''
@@ -533,39 +1437,8 @@ def ids_in(block):
 # --- Finding provinces ---
 #
 # abbreviations and full state names are listed in geography.txt and
-# locations.txt so grab each of them
-
-# I could just use a string, but I want to '|'.join(loc_names) so it'll be
-# easier to '|' the two to gether
-loc_names = []
-for fn in ('geography.txt', 'locations.txt'):
-    path = Path.joinpath(file_dir, fn)
-    with open(path) as f:
-        s = f.read()
-        # these are special regex charaters, so escape them wherever they
-        # appear
-        for r in ('.', '(', ')'):
-            s = s.replace(r, '\\'+r)
-        # I want to '|' each province name, but since they have non-alphabetic
-        # characters I need to group each name w/o capturing, hence the (?:)
-        #
-        # Also cut off the last blank line
-        loc_names.extend('(?:'+m+')' for m in s.split('\n')[:-1])
-
-# If one string is a substring of another, regex will match with whatever
-# comes first in the pattern. We want to match the longest substrings possible
-# so sort the location names by length
-#
-# Also replace spaces in each name with arbitrary whitespace
-loc_names = sorted((loc.replace(' ', r'\s*') for loc in loc_names),
-                   key=len, reverse=True)
-
-# Assumes locations have the following format:
-#
-# {<beginning of line>, <;> or <,>} {location name (may include newlines)}{<;>,
-#  <,> or <end of line>}
-loc_pattern_str = r'[^;,]\s*('+'|'.join(loc_names)+r')(?:[;,]|\s*?$|\s*?\n)'
-loc_pattern = re.compile(loc_pattern_str, re.MULTILINE)
+# locations.txt, so look for each of them with a trie of the names (see
+# gazetteer.location_trie)
 
 # --- Location Paragraph Pattern ---
 #
@@ -576,63 +1449,197 @@ loc_pattern = re.compile(loc_pattern_str, re.MULTILINE)
 #
 # The line doesn't necessarily begin at 0, but a line does end at '.\n'
 
-loc_text_pattern = re.compile(r'0[\)\]]?\s+?m;.*?(?<!Nfld|Labr|..St)'+
-                              r'\.\s*?(?:\n|$)', re.DOTALL|re.MULTILINE)
-loc_exception_pattern = re.compile(r'(?:Flowering.*?;|introduced;)' \
-                                   r'.*?\.\s*?(?:\n|$)', re.DOTALL|re.MULTILINE)
-
-# load the key which maps full state and province names to their abbreviations
+#
+# The paragraph is found in two steps so that the cost of finding it grows
+# linearly with the block: first its start, then the first '.' after it that
+# ends a line. Searching for the whole paragraph with one pattern (".*?" from
+# each possible start) rescans the rest of the block from every start that
+# doesn't lead to an end, which took minutes on some malformed OCR text.
+#
+# When there's no "0 m;" paragraph, the locations follow the flowering time
+# ("Flowering ...;") or "introduced;" instead.
+loc_start_pattern = re.compile(r'0[\)\]]?\s+?m;')
+loc_exception_start_pattern = re.compile(r'Flowering|introduced;')
+
+# The '.' that ends a line and the paragraph, which isn't the end of one of
+# the abbreviations "Nfld.", "Labr." or "St." (except after the flowering
+# time)
+loc_end_pattern = re.compile(r'(?<!Nfld|Labr|..St)\.\s*?(?:\n|$)',
+                             re.DOTALL|re.MULTILINE)
+loc_exception_end_pattern = re.compile(r'\.\s*?(?:\n|$)', re.MULTILINE)
+
+# Baja California is in Mexico, but California would be found in its name
+baja_pattern = re.compile(r'[Bb]aja\s*[Cc]alifornia')
+
+# The key maps full state and province names to their abbreviations
 key_fn = 'key.json'
 key_path = Path.joinpath(file_dir, key_fn)
 
-key = {}
-with open(key_path) as f:
-    key = json.load(f)
+@functools.lru_cache(maxsize=None)
+def load_key():
+    """Return the key, loading it on first use."""
+    with open(key_path) as f:
+        return json.load(f)
 
-def locs_in(block):
+def loc_span(block, pos=0, endpos=None):
+    """Return the start and end of the locations paragraph in a block or None.
+
+    Parameters:
+        block - a block of text (a string) with its scope limited to a single
+                species or subspecies
+        pos, endpos - the span of the block if block is the whole treatment
+                      text (defaults to all of block)
+
+    Each character of the block is only looked at a few times, however the
+    block is malformed.
+    """
+    if endpos is None:
+        endpos = len(block)
+
+    # Only the first start of each kind can lead to an end: a later start
+    # would have to end at an end that comes after the first start as well
+    start = loc_start_pattern.search(block, pos, endpos)
+    if start:
+        end = loc_end_pattern.search(block, start.end(), endpos)
+        if end:
+            return start.start(), end.end()
+
+    start = loc_exception_start_pattern.search(block, pos, endpos)
+    if not start:
+        return None
+    body = start.end()
+    if start[0] == 'Flowering':
+        body = block.find(';', body, endpos)+1
+        if not body:
+            return None
+
+    end = loc_exception_end_pattern.search(block, body, endpos)
+    if not end:
+        return None
+    return start.start(), end.end()
+
+def locs_in(block, pos=0, endpos=None):
     """Generates the locations that a species appears in.
 
     Parameters:
         block - a block of text (a string) with its scope limited to a single
                 species or subspecies
+        pos, endpos - the span of the block if block is the whole treatment
+                      text (defaults to all of block)
     """
+    if endpos is None:
+        endpos = len(block)
+
     # First find the locations paragraph
-    loc_match = loc_text_pattern.search(block)
-    if not loc_match:
-        loc_match = loc_exception_pattern.search(block)
-    loc_text = ""
-    if loc_match:
-        loc_text = loc_match[0]
-
-    # find all states and provinces in the paragraph
-    locs = loc_pattern.findall(re.sub('[Bb]aja\s*[Cc]alifornia', '', loc_text))
+    span = loc_span(block, pos, endpos)
+    if span:
+        yield from span_locations(block, *span)
+
+def span_locations(block, start, end):
+    """Return the tuple of locations in a locations paragraph.
+
+    Parameters:
+        block - the text the paragraph is in
+        start, end - the span of the paragraph, as returned by loc_span
+    """
+    # find all states and provinces in the paragraph, which only has to be
+    # copied if Baja California has to be taken out of it
+    if baja_pattern.search(block, start, end):
+        loc_text = baja_pattern.sub('', block[start:end])
+        locs = gazetteer.location_trie().findall(loc_text)
+    else:
+        locs = gazetteer.location_trie().findall(block, start, end)
    
     # remove duplicates
     #locs = {key[loc] if loc in key else loc for loc in matches}
 
-    for loc in locs:
-        # in replace all whitespace with a single space
-        loc = ' '.join(loc.split())
-
-        # convert full state and province names to their abbreviations
-        if loc in key:
-            loc = key[loc]
-
-        # Handle Nfld/Labr differentiation
-
-        # if specified, yield the relevant one
-        if '(Labr.)' in loc:
-            yield 'Labr.'
-        elif '(Nfld.)' in loc:
-            yield 'Nfld.'
-        # otherwise yield both if both
-        elif 'Nfld' in loc and 'Labr' in loc:
-            yield 'Nfld.'
-            yield 'Labr.'
-
-        # now that these cases have been handled, yield as usual
-        elif loc:
-            yield loc
+    return tuple([code for loc in locs for code in location_codes(loc)])
+
+@functools.lru_cache(maxsize=None)
+def location_codes(loc):
+    """Return the tuple of canonical_locations of a location name.
+
+    The same few hundred names are found in every treatment, so each is only
+    made canonical once.
+    """
+    return tuple(canonical_locations(loc))
+
+def canonical_locations(loc, key=None):
+    """Generate the locations a location name found in the text stands for.
+
+    Parameters:
+        loc - a location name as it's found in the text
+        key - the key of full names to abbreviations (defaults to load_key())
+
+    Most names stand for one location, given by its abbreviation.
+    Newfoundland and Labrador stands for both "Nfld." and "Labr." unless one
+    of them is specified.
+    """
+    if key is None:
+        key = load_key()
+
+    # Spell the name the way the gazetteer does, since the text can have any
+    # whitespace (or none) where the name has a space
+    loc = gazetteer.location_trie().spelling(loc)
+
+    # convert full state and province names to their abbreviations
+    if loc in key:
+        loc = key[loc]
+
+    # Handle Nfld/Labr differentiation
+
+    # if specified, yield the relevant one
+    if '(Labr.)' in loc:
+        yield 'Labr.'
+    elif '(Nfld.)' in loc:
+        yield 'Nfld.'
+    # otherwise yield both if both
+    elif 'Nfld' in loc and 'Labr' in loc:
+        yield 'Nfld.'
+        yield 'Labr.'
+
+    # now that these cases have been handled, yield as usual
+    elif loc:
+        yield loc
+
+# --- Analyzing species blocks ---
+#
+# Each block is read about once: the classifiers are on one of its first
+# lines, where ids_in stops, and loc_span reads on from the start of the
+# block to the end of the locations paragraph. The locations are then only
+# looked for in the paragraph.
+#
+# Searching for the classifiers and both kinds of paragraph start with one
+# alternation pattern reads the block once as well, but python's re module
+# then tries the pattern at every position of the block instead of skipping
+# ahead to the literal text each search starts with, which made it several
+# times slower.
+
+# The version of how blocks are parsed, which incremental runs are keyed by
+# (see manifest.config_fingerprint). Change it whenever a change to
+# analyze_block, or to anything it uses, could find different classifiers or
+# locations.
+parser_version = 2
+
+def analyze_block(block, pos=0, endpos=None):
+    """Return the classifiers and the tuple of locations of a species.
+
+    Parameters:
+        block - a block of text (a string) with its scope limited to a single
+                species or subspecies
+        pos, endpos - the span of the block if block is the whole treatment
+                      text (defaults to all of block)
+
+    The result is the same as that of ids_in and locs_in.
+    """
+    if endpos is None:
+        endpos = len(block)
+
+    ids = ids_in(block, pos, endpos)
+    span = loc_span(block, pos, endpos)
+    if not span:
+        return ids, ()
+    return ids, span_locations(block, *span)
 
 if __name__ == '__main__':
     main()
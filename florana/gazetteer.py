@@ -0,0 +1,169 @@
+import re
+import json
+import hashlib
+import warnings
+import functools
+
+from pathlib import Path
+
+file_dir = Path(__file__).parent.absolute()
+
+# abbreviations and full state names are listed in geography.txt and
+# locations.txt
+gazetteer_files = ('geography.txt', 'locations.txt')
+
+# The prebuilt location pattern, generated from the gazetteer files with
+#
+#   python -m florana.gazetteer
+artifact_fn = 'gazetteer.json'
+
+def load_names(directory=file_dir):
+    """Return the list of location names in the gazetteer files.
+
+    Parameters:
+        directory - the directory with the gazetteer files (defaults to the
+                    florana package directory)
+    """
+    names = []
+    for fn in gazetteer_files:
+        with open(Path.joinpath(Path(directory), fn)) as f:
+            # cut off the last blank line
+            names.extend(f.read().split('\n')[:-1])
+    return names
+
+# --- Location matching ---
+#
+# Assumes locations have the following format:
+#
+# {<beginning of line>, <;> or <,>} {location name (may include newlines)}{<;>,
+#  <,> or <end of line>}
+#
+# The location names are stored in a character trie, where a space in a name
+# matches an arbitrary amount of whitespace (including none). The trie is
+# compiled into a single pattern with one branch per character, so the text
+# is scanned once and at each place a location could start only the names
+# beginning with that character are followed. Each branch tries to continue
+# the name before ending it, which gives the longest name that's followed by
+# a delimiter.
+
+class LocationTrie:
+    """A character trie of location names for finding locations in text.
+
+    Parameters:
+        names - the location names to look for
+        pattern - the pattern string prebuilt from the same names, if any
+    """
+    def __init__(self, names, pattern=None):
+        # Each node maps a character to the next node and None to the name
+        # that ends at the node
+        self.root = {}
+        for name in names:
+            node = self.root
+            for c in name:
+                node = node.setdefault(c, {})
+            node.setdefault(None, name)
+
+        # A space in a name matches any whitespace, so the names are also
+        # looked up with their whitespace taken out
+        self.spellings = {''.join(name.split()): name for name in names}
+
+        # The pattern may have been prebuilt from the same names
+        if not pattern:
+            pattern = r'[^;,]\s*('+self.branch(self.root)+\
+                      r')(?:[;,]|\s*?$|\s*?\n)'
+        self.pattern = re.compile(pattern, re.MULTILINE)
+
+    def branch(self, node):
+        """Return the pattern matching the rest of each name below node."""
+        branches = []
+        for c, child in node.items():
+            if c is None:
+                continue
+            head = r'\s*' if c == ' ' else re.escape(c)
+            branches.append(head+self.branch(child))
+
+        # Ending the name here is the last resort
+        if None in node:
+            branches.append('')
+
+        if len(branches) == 1:
+            return branches[0]
+        return '(?:'+'|'.join(branches)+')'
+
+    def findall(self, text, pos=0, endpos=None):
+        """Return the list of location names as they're written in text.
+
+        Parameters:
+            text - the text to search
+            pos, endpos - the span of text to search (defaults to all of it)
+        """
+        if endpos is None:
+            endpos = len(text)
+        return self.pattern.findall(text, pos, endpos)
+
+    def spelling(self, found):
+        """Return the name in the gazetteer of a location found in text.
+
+        The name found may have more or less whitespace than the name in the
+        gazetteer, or none at all (as in "BritishColumbia").
+        """
+        return self.spellings.get(''.join(found.split()), found)
+
+# --- Prebuilt gazetteer ---
+#
+# Rather than reading the gazetteer files and building the location pattern
+# every time florana starts, the names and pattern are stored in
+# gazetteer.json along with the hashes of the files they were built from. If
+# the files have changed since, the artifact is stale and is ignored.
+
+def source_hashes(directory=file_dir):
+    """Return a dict of the sha256 hex digest of each gazetteer file."""
+    hashes = {}
+    for fn in gazetteer_files:
+        with open(Path.joinpath(Path(directory), fn), 'rb') as f:
+            hashes[fn] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+def build_artifact(directory=file_dir):
+    """Build the prebuilt gazetteer from the gazetteer files in directory."""
+    names = load_names(directory)
+    trie = LocationTrie(names)
+    return {'sources': source_hashes(directory), 'names': names,
+            'pattern': trie.pattern.pattern}
+
+def write_artifact(directory=file_dir):
+    """Write the prebuilt gazetteer for the gazetteer files in directory."""
+    path = Path.joinpath(Path(directory), artifact_fn)
+    with open(path, 'w') as f:
+        json.dump(build_artifact(directory), f, indent=1)
+        f.write('\n')
+    return path
+
+@functools.lru_cache(maxsize=None)
+def location_trie(directory=file_dir):
+    """Return the LocationTrie of the gazetteer, loading it on first use.
+
+    Parameters:
+        directory - the directory with the gazetteer files (defaults to the
+                    florana package directory)
+
+    The prebuilt gazetteer is used if it's up to date with the gazetteer
+    files, otherwise the trie is built from the files themselves.
+    """
+    path = Path.joinpath(Path(directory), artifact_fn)
+    try:
+        with open(path) as f:
+            artifact = json.load(f)
+    except FileNotFoundError:
+        artifact = None
+
+    if artifact and artifact['sources'] == source_hashes(directory):
+        return LocationTrie(artifact['names'], pattern=artifact['pattern'])
+
+    if artifact:
+        warnings.warn(f'{path} is out of date with the gazetteer files; run '
+                      '"python -m florana.gazetteer" to rebuild it')
+    return LocationTrie(load_names(directory))
+
+if __name__ == '__main__':
+    print(f'Wrote {write_artifact()}')
@@ -0,0 +1,180 @@
+import functools
+
+from . import extract
+from . import gazetteer
+
+# numpy is only needed for the incidence matrix, so florana works without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# --- Species by location incidence ---
+#
+# The incidence matrix has a row for each species (and subspecies) and a
+# column for each location, and is True where the species appears in the
+# location. The columns are always the same: every location locs_in can find,
+# in the order of the gazetteer, so the matrices of different treatments and
+# runs line up and merging them is just stacking their rows.
+
+def require_numpy():
+    """Raise a RuntimeError if numpy isn't installed."""
+    if np is None:
+        raise RuntimeError('The incidence matrix needs numpy; install it '
+                           'with "python -m pip install numpy"')
+
+@functools.lru_cache(maxsize=None)
+def location_columns(directory=gazetteer.file_dir):
+    """Return the tuple of locations locs_in can find, in gazetteer order.
+
+    Parameters:
+        directory - the directory with the gazetteer files (defaults to the
+                    florana package directory)
+
+    Abbreviations come first, in the order of geography.txt, followed by any
+    full names that aren't in the key.
+    """
+    key = extract.load_key()
+    names = gazetteer.load_names(directory)
+    return tuple(dict.fromkeys(loc for name in names
+                               for loc in extract.canonical_locations(name,
+                                                                      key)))
+
+class Incidence:
+    """A boolean species by location matrix.
+
+    Parameters:
+        species - the name of the species of each row
+        matrix - a boolean numpy array with a row for each species and a
+                 column for each location
+        locations - the location of each column (defaults to
+                    location_columns())
+    """
+    def __init__(self, species, matrix, locations=None):
+        require_numpy()
+        self.species = list(species)
+        self.locations = tuple(locations or location_columns())
+        self.matrix = np.asarray(matrix, dtype=bool)
+        if self.matrix.shape != (len(self.species), len(self.locations)):
+            raise ValueError(f'The matrix has shape {self.matrix.shape}, '
+                             f'not ({len(self.species)}, '
+                             f'{len(self.locations)})')
+
+    @classmethod
+    def from_records(cls, records, locations=None):
+        """Build the matrix of the SpeciesRecords of a treatment.
+
+        Parameters:
+            records - the SpeciesRecords, one row each in the same order
+            locations - the location of each column (defaults to
+                        location_columns())
+
+        Raises a ValueError if a record has a location that isn't a column.
+        """
+        require_numpy()
+        locations = tuple(locations or location_columns())
+        columns = {location: j for j, location in enumerate(locations)}
+
+        records = list(records)
+        rows, cols = [], []
+        for i, record in enumerate(records):
+            for location in record.locations:
+                try:
+                    cols.append(columns[location])
+                except KeyError:
+                    raise ValueError(f'"{location}" of {record.name} is not '
+                                     'in the gazetteer') from None
+                rows.append(i)
+
+        matrix = np.zeros((len(records), len(locations)), dtype=bool)
+        matrix[rows, cols] = True
+        return cls([record.name for record in records], matrix, locations)
+
+    @classmethod
+    def merge(cls, incidences):
+        """Merge the matrices of several treatments or runs into one.
+
+        The rows of a species that's in more than one matrix are combined, so
+        it appears wherever it appears in any of them. The species are kept
+        in the order they first appear in.
+
+        Raises a ValueError if the matrices have different locations.
+        """
+        require_numpy()
+        incidences = list(incidences)
+        if not incidences:
+            locations = location_columns()
+            return cls([], np.zeros((0, len(locations)), dtype=bool))
+
+        locations = incidences[0].locations
+        if any(incidence.locations != locations for incidence in incidences):
+            raise ValueError("Matrices with different locations can't be "
+                             "merged")
+
+        rows = {}
+        for incidence in incidences:
+            for name in incidence.species:
+                rows.setdefault(name, len(rows))
+
+        stacked = np.concatenate([incidence.matrix
+                                  for incidence in incidences])
+        index = np.fromiter((rows[name] for incidence in incidences
+                             for name in incidence.species),
+                            dtype=np.intp, count=len(stacked))
+        matrix = np.zeros((len(rows), len(locations)), dtype=bool)
+        np.logical_or.at(matrix, index, stacked)
+        return cls(list(rows), matrix, locations)
+
+    def save(self, path):
+        """Save the matrix with its labels to a compressed .npz file.
+
+        The file has three arrays: "matrix", "species" and "locations".
+        """
+        np.savez_compressed(path, matrix=self.matrix,
+                            species=np.array(self.species, dtype=str),
+                            locations=np.array(self.locations, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        """Load a matrix saved with save."""
+        require_numpy()
+        with np.load(path) as data:
+            return cls(data['species'].tolist(), data['matrix'],
+                       data['locations'].tolist())
+
+    # --- Queries ---
+
+    def column(self, location):
+        """Return the column of a location, raising a KeyError if unknown."""
+        try:
+            return self.locations.index(location)
+        except ValueError:
+            raise KeyError(location) from None
+
+    def species_counts(self):
+        """Return the number of species in each location, by location."""
+        return dict(zip(self.locations, self.matrix.sum(axis=0).tolist()))
+
+    def location_counts(self):
+        """Return the number of locations of each species, by species."""
+        return dict(zip(self.species, self.matrix.sum(axis=1).tolist()))
+
+    def species_in(self, *locations):
+        """Return the species that appear in every one of the locations."""
+        columns = [self.column(location) for location in locations]
+        rows = self.matrix[:, columns].all(axis=1)
+        return [self.species[i] for i in np.flatnonzero(rows)]
+
+    def locations_of(self, species):
+        """Return the locations a species appears in."""
+        row = self.matrix[self.species.index(species)]
+        return [self.locations[j] for j in np.flatnonzero(row)]
+
+    def cooccurrence(self):
+        """Return the number of species each pair of locations share.
+
+        The result is a square integer array with a row and a column for each
+        location, whose diagonal is the number of species in each location.
+        """
+        counts = self.matrix.astype(np.int32)
+        return counts.T @ counts
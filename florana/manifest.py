@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from pathlib import Path
+
+from . import __version__
+from . import cache as text_cache
+from . import gazetteer
+
+# --- Incremental runs ---
+#
+# The manifest records every treatment that was extracted: its size,
+# modification time and content hash, the version of florana and the pdf
+# backend it was extracted with, and what was extracted from it. On the next
+# run a treatment that hasn't changed is taken from the manifest instead of
+# being extracted again.
+#
+# The version of florana stays the same while the gazetteer, the location key
+# and the parser are tuned, so each entry also records a fingerprint of them
+# (and of how the treatment was read and its errors recorded). A treatment
+# extracted with a different fingerprint is extracted again.
+
+def config_fingerprint(stream=False, volume=False, excerpt=200):
+    """Return a hash of how treatments are extracted, besides the backend.
+
+    Parameters:
+        stream - whether pdfs are read until the references (defaults to
+                 False)
+        volume - whether pdfs are whole volumes (defaults to False)
+        excerpt - how many characters of the text of each error are kept, or
+                  None for all of it (defaults to 200)
+
+    The hash covers the gazetteer files, the location key, the versions of
+    the partitioner and the parser, how the pdfs are read and how much of
+    each error's text is kept.
+    """
+    # Imported here since extract imports this module
+    from . import extract
+
+    with open(extract.key_path, 'rb') as f:
+        key = hashlib.sha256(f.read()).hexdigest()
+    config = {'gazetteer': gazetteer.source_hashes(), 'key': key,
+              'partitioner': extract.partitioner_version,
+              'parser': extract.parser_version, 'stream': stream,
+              'volume': volume, 'excerpt': excerpt}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()) \
+                  .hexdigest()
+
+class Manifest:
+    """A json manifest of extracted treatments and their results.
+
+    Parameters:
+        path - the file name of the manifest, which is read if it exists
+        fingerprint - the fingerprint of how treatments are extracted in this
+                      run (defaults to config_fingerprint())
+    """
+    def __init__(self, path, fingerprint=None):
+        self.path = Path(path)
+        self.fingerprint = fingerprint or config_fingerprint()
+        try:
+            with open(self.path, encoding='utf8') as f:
+                self.treatments = json.load(f)['treatments']
+        except FileNotFoundError:
+            self.treatments = {}
+
+    def unchanged(self, treatment, backend):
+        """Return whether treatment was extracted the same way before.
+
+        Parameters:
+            treatment - the file name of the treatment
+            backend - the name of the pdf backend it would be extracted with
+
+        The treatment is unchanged if it was extracted by this version of
+        florana with the same backend and fingerprint and its contents haven't
+        changed. The contents are only hashed if its size or modification time
+        have. Entries written before errors were recorded as JSON Lines are
+        always extracted again.
+        """
+        entry = self.treatments.get(str(treatment))
+        if not entry or entry['florana'] != __version__ or \
+           entry['backend'] != backend or 'errors' not in entry or \
+           entry.get('fingerprint') != self.fingerprint:
+            return False
+
+        stat = os.stat(treatment)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns != entry['mtime']:
+            if text_cache.file_hash(treatment) != entry['sha256']:
+                return False
+            entry['mtime'] = stat.st_mtime_ns
+        return True
+
+    def results(self, treatment):
+        """Return what was extracted from treatment before.
+
+        The results have the same format as those of extract_from, without
+        "profile" and with "cache" set to "manifest".
+        """
+        # Imported here since extract imports this module
+        from .extract import SpeciesRecord, location_rows, classifier_rows
+
+        entry = self.treatments[str(treatment)]
+        records = [SpeciesRecord(genus, species, rank, infraspecies,
+                                 classifiers, tuple(locations), start, end)
+                   for genus, species, rank, infraspecies, classifiers,
+                       locations, start, end in entry['records']]
+        return {'locations': list(location_rows(records)),
+                'classifiers': list(classifier_rows(records)),
+                'records': records, 'error': entry['error'],
+                'errors': entry['errors'], 'cache': 'manifest',
+                'timeout': False}
+
+    def update(self, treatment, backend, results):
+        """Record the results of extracting treatment with backend."""
+        stat = os.stat(treatment)
+        self.treatments[str(treatment)] = {
+            'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'sha256': text_cache.file_hash(treatment),
+            'florana': __version__, 'backend': backend,
+            'fingerprint': self.fingerprint,
+            'records': results['records'], 'error': results['error'],
+            'errors': results['errors']}
+
+    def save(self):
+        """Write the manifest, replacing the old one all at once."""
+        directory = self.path.absolute().parent
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as f:
+                json.dump({'florana': __version__,
+                           'treatments': self.treatments}, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
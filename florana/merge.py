@@ -0,0 +1,230 @@
+import json
+import heapq
+import argparse
+import textwrap
+
+from pathlib import Path
+
+from . import extract
+
+# --- Sharding ---
+#
+# A corpus can be split between several runs (on different machines, say)
+# with --shard i/N, then merged back together with
+#
+#   python -m florana.merge -o data.csv node-*/florana-shard-*.json
+#
+# Every shard assigns the treatments the same way, so each treatment is in
+# exactly one shard. Each shard writes an index next to its errors.jsonl with
+# the sorted names of all the treatments of the run, the position of each of
+# its own treatments in that list and how many bytes it wrote to each output
+# file. The merge copies those bytes back in the
+# order of the whole run, so the merged files are the same as those of a
+# single run, and only reads each shard's files once, from start to end.
+
+def index_name(shard, shards):
+    """Return the file name of the index of a shard."""
+    return f'florana-shard-{shard}-of-{shards}.json'
+
+def parse_shard(spec):
+    """Return the shard number and number of shards of an "i/N" spec.
+
+    Shards are numbered from 1 to N. Raises a ValueError if the spec isn't
+    of that form.
+    """
+    try:
+        shard, shards = map(int, spec.split('/'))
+    except ValueError:
+        raise ValueError(f'"{spec}" is not a shard: expected i/N') from None
+    if not 1 <= shard <= shards:
+        raise ValueError(f'Shard {shard} of {shards} is out of range: it '
+                         'must be between 1 and the number of shards')
+    return shard, shards
+
+def shard_positions(sizes, shard, shards):
+    """Return the positions of the treatments in a shard, in order.
+
+    Parameters:
+        sizes - the size of each treatment in the whole run, in order
+        shard - the shard number, from 1 to shards
+        shards - the number of shards
+
+    The biggest treatments are handed out first, each to the shard with the
+    fewest bytes so far (the first such shard on a tie). The result only
+    depends on the sizes, so every shard hands out the same treatments.
+    """
+    totals = [(0, k) for k in range(shards)]
+    positions = []
+    for position in sorted(range(len(sizes)), key=lambda k: (-sizes[k], k)):
+        total, k = heapq.heappop(totals)
+        if k == shard-1:
+            positions.append(position)
+        heapq.heappush(totals, (total+sizes[position], k))
+    return sorted(positions)
+
+def write_index(shard, shards, names, outputs, entries):
+    """Write the index of a shard to the current directory.
+
+    Parameters:
+        shard, shards - the shard number and the number of shards
+        names - the file name of each treatment in the whole run, in order
+        outputs - the locations and classifiers file names written with -o,
+                  or None if each treatment was written to its own files
+        entries - the position, file name and number of bytes written to the
+                  locations file, classifiers file and errors.jsonl of each
+                  treatment of the shard, in order
+    """
+    with open(index_name(shard, shards), 'w', encoding='utf8') as f:
+        json.dump({'shard': shard, 'shards': shards,
+                   'treatments': len(names), 'names': names,
+                   'outputs': outputs, 'entries': entries}, f)
+
+# --- Merging ---
+
+def copy_bytes(src, dst, size, chunk_size=1024*1024):
+    """Copy size bytes from the file src to the file dst."""
+    while size > 0:
+        chunk = src.read(min(size, chunk_size))
+        if not chunk:
+            raise ValueError(f'{src.name} is shorter than its shard index')
+        dst.write(chunk)
+        size -= len(chunk)
+
+def load_indexes(paths):
+    """Load the shard indexes and check that they make up one whole run.
+
+    Returns a list of (directory, index) pairs, in shard order. Raises a
+    ValueError if shards are missing, repeated or from different runs, or if
+    they don't agree on the position of each treatment.
+    """
+    indexes = []
+    for path in paths:
+        with open(path, encoding='utf8') as f:
+            indexes.append((Path(path).parent, json.load(f)))
+    if not indexes:
+        raise ValueError('There are no shards to merge.')
+
+    first = indexes[0][1]
+    for _, index in indexes:
+        if (index['shards'], index['treatments'], index['outputs']) != \
+           (first['shards'], first['treatments'], first['outputs']):
+            raise ValueError('The shards are from different runs.')
+        if index.get('names') != first.get('names') or \
+           len(first['names']) != first['treatments']:
+            raise ValueError("The shards don't have the same treatments: "
+                             "each one has to be given the same list of "
+                             "treatments, from the same directory.")
+
+    # Each entry has to be the treatment every shard has at its position
+    names = first['names']
+    for _, index in indexes:
+        for position, treatment, *_ in index['entries']:
+            if not 0 <= position < len(names) or \
+               names[position] != treatment:
+                raise ValueError(f'Shard {index["shard"]} has {treatment} '
+                                 f'at position {position} of the run.')
+
+    shards = sorted(index['shard'] for _, index in indexes)
+    if shards != list(range(1, first['shards']+1)):
+        raise ValueError(f'Expected shards 1 to {first["shards"]}, got '
+                         f'{", ".join(map(str, shards))}.')
+
+    # Each shard only has the treatments that weren't skipped, so every
+    # position can only be in one shard
+    positions = [entry[0] for _, index in indexes
+                 for entry in index['entries']]
+    if len(positions) != len(set(positions)):
+        raise ValueError('A treatment is in more than one shard.')
+    if len(positions) != first['treatments']:
+        raise ValueError(f'The shards have {len(positions)} of the '
+                         f'{first["treatments"]} treatments of the run: a '
+                         'shard may not have finished.')
+
+    return sorted(indexes, key=lambda pair: pair[1]['shard'])
+
+def merge(paths, fn=None, error_log='errors.jsonl'):
+    """Merge the output of the shards of a run.
+
+    Parameters:
+        paths - the index file of each shard
+        fn - the locations file to merge into, along with its classifiers
+             file (defaults to the file name the shards were written with)
+        error_log - the file to merge the error logs into (defaults to
+                    "errors.jsonl")
+
+    Returns the number of treatments merged.
+    """
+    indexes = load_indexes(paths)
+    outputs = indexes[0][1]['outputs']
+
+    # The files each part of an entry was written to and is merged into
+    names = [*(outputs or [None, None]), 'errors.jsonl']
+    if outputs and fn:
+        targets = [*extract.output_names(fn), error_log]
+    elif outputs:
+        targets = [*outputs, error_log]
+    else:
+        targets = [None, None, error_log]
+
+    # Each shard's entries are in order, so merging them gives the order of
+    # the whole run
+    entries = heapq.merge(*([(*entry, k) for entry in index['entries']]
+                            for k, (_, index) in enumerate(indexes)))
+
+    sources = [[None]*3 for _ in indexes]
+    dsts = [None]*3
+    merged = 0
+    try:
+        for position, treatment, *sizes, k in entries:
+            directory = indexes[k][0]
+            for part, size in enumerate(sizes):
+                if not size:
+                    continue
+                if not sources[k][part]:
+                    sources[k][part] = open(directory/names[part], 'rb')
+                if not dsts[part]:
+                    dsts[part] = open(targets[part], 'wb')
+                copy_bytes(sources[k][part], dsts[part], size)
+            merged += 1
+
+        # Files are written even if no treatment wrote anything to them, as
+        # a single run would have, except for errors.jsonl
+        for part in (0, 1):
+            if targets[part] and not dsts[part]:
+                dsts[part] = open(targets[part], 'wb')
+    finally:
+        for f in [f for files in sources for f in files]+dsts:
+            if f:
+                f.close()
+    return merged
+
+def main():
+    description = '''
+            Merge the output of the shards of a run of florana.extract
+            (see --shard) into the output of a single run.
+
+            Example usage:
+
+                python -m florana.merge -o data.csv node-*/florana-shard-*.json
+    '''
+    prog = 'python -m florana.merge'
+
+    fmt_class = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=fmt_class,
+                                     description=textwrap.dedent(description),
+                                     prog=prog)
+    parser.add_argument('indexes', metavar='INDEX', nargs='+',
+                        help='the index file each shard wrote')
+    parser.add_argument('-o', action='store',
+                        help='the output file (csv) to merge into (defaults '
+                             'to the one the shards were written to)')
+    parser.add_argument('--error-log', default='errors.jsonl', metavar='FILE',
+                        help='where to merge the error logs to (defaults to '
+                             '%(default)s)')
+    args = parser.parse_args()
+
+    merged = merge(args.indexes, fn=args.o, error_log=args.error_log)
+    print(f'Merged {merged} treatments from {len(args.indexes)} shards')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import asyncio
+
+from pathlib import Path
+
+from . import backends
+from . import extract
+
+# --- Overlapping pdf conversion and parsing ---
+#
+# Converting a pdf to text mostly waits on the converter, while parsing the
+# text keeps python busy. The pipeline runs several conversions at once and
+# parses each text as soon as it's ready, while the rest are still being
+# converted:
+#
+#   treatments -> conversions (at most `conversions` at a time)
+#              -> bounded queue, in the order of the treatments
+#              -> parsing, one treatment at a time in a worker thread
+#
+# When the parser falls behind the queue fills up and no more conversions are
+# started until it catches up, so only a few texts are ever held at once.
+
+async def load_treatment(treatment, encoding='utf-8', cache=None,
+                         backend=backends.default_backend, stream=False):
+    """Load the treatment text like extract.load_treatment, without blocking.
+
+    Returns the text along with whether it was a cache "hit" or "miss" (or
+    an empty string if there's no cache).
+
+    pdftotext is run as an asyncio subprocess. The other backends, and
+    streamed pages, are extracted in a worker thread.
+    """
+    extractor = backends.get_backend(backend)
+    path = Path.joinpath(Path.cwd(), treatment)
+
+    if cache:
+        key = cache.key(path, encoding, extract.cache_name(backend, stream))
+        text = cache.get(key)
+        if text is not None:
+            return text, 'hit'
+
+    if stream or not isinstance(extractor, backends.PdftotextBackend):
+        text = await asyncio.to_thread(extract.load_treatment, treatment,
+                                       encoding=encoding, backend=backend,
+                                       stream=stream)
+    else:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                    *extractor.command(path, encoding),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError('pdftotext was not found; install poppler or '
+                               'choose another backend') from None
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            message = stderr.decode(errors='replace').strip()
+            raise RuntimeError(f'pdftotext failed on {path}: {message}')
+        text = stdout.decode(encoding)
+
+    if not cache:
+        return text, ''
+    cache.put(key, text)
+    return text, 'miss'
+
+async def pipeline(treatments, conversions=4, queue_size=None, cache=None,
+                   backend=backends.default_backend, stream=False,
+                   budget=None, partitions=None, excerpt=200):
+    """Generate the results of extract_from for each treatment, in order.
+
+    Parameters:
+        treatments - a list of pdf file names of genus treatments
+        conversions - how many pdfs to convert to text at a time (defaults
+                      to 4)
+        queue_size - how many treatments can be converted (or be converting)
+                     ahead of the parser (defaults to twice conversions)
+        cache, backend, stream - passed on to load_treatment
+        budget - how many seconds parsing each treatment may take, as
+                 described by extract.extract_from (defaults to None)
+        partitions - the PartitionCache to reuse the partition of each
+                     treatment from (defaults to None)
+        excerpt - how much of the text of each error to keep, as described by
+                  extract.extract_from (defaults to 200)
+    """
+    limit = asyncio.Semaphore(conversions)
+    queue = asyncio.Queue(queue_size or 2*conversions)
+
+    async def convert(treatment):
+        async with limit:
+            return await load_treatment(treatment, cache=cache,
+                                        backend=backend, stream=stream)
+
+    # Queue the conversion of each treatment in order, waiting whenever the
+    # queue is full
+    async def produce():
+        for treatment in treatments:
+            await queue.put(asyncio.create_task(convert(treatment)))
+
+    producer = asyncio.create_task(produce())
+    converting = []
+    try:
+        for _ in treatments:
+            conversion = await queue.get()
+            converting.append(conversion)
+            text, cached = await conversion
+            converting.remove(conversion)
+
+            # Parse in a thread so the conversions keep being read meanwhile
+            results = await asyncio.to_thread(extract.results_from, text,
+                                              budget=budget,
+                                              partitions=partitions,
+                                              excerpt=excerpt)
+            results['cache'] = cached
+            yield results
+
+    # Stop converting if the results stop being read
+    finally:
+        producer.cancel()
+        while not queue.empty():
+            converting.append(queue.get_nowait())
+        for conversion in converting:
+            conversion.cancel()
+        await asyncio.gather(producer, *converting, return_exceptions=True)
+
+def extract_pipelined(treatments, conversions=4, queue_size=None, cache=None,
+                      backend=backends.default_backend, stream=False,
+                      budget=None, partitions=None, excerpt=200):
+    """Generate the results of extract_from for each treatment, in order.
+
+    Parameters are the same as pipeline's. This runs the pipeline in its own
+    event loop, so it can be used in place of extract_all.
+    """
+    loop = asyncio.new_event_loop()
+    results = pipeline(treatments, conversions=conversions,
+                       queue_size=queue_size, cache=cache, backend=backend,
+                       stream=stream, budget=budget, partitions=partitions,
+                       excerpt=excerpt)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
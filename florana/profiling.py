@@ -0,0 +1,170 @@
+import time
+import json
+import marshal
+import cProfile
+import tracemalloc
+
+from pathlib import Path
+
+# --- Profiling extraction runs ---
+#
+# The time and memory spent by each treatment is recorded per stage of the
+# extraction. Stages may be entered many times per treatment (once for each
+# species block), so times are summed and the peak memory is the highest seen
+# in any one of them.
+
+class StageProfiler:
+    """Record the wall time, CPU time and peak memory of extraction stages.
+
+    Parameters:
+        enabled - whether to record anything (defaults to True)
+        cprofile - whether to also run cProfile while profiling (defaults to
+                   False)
+
+    Use the profiler as a context manager around the whole treatment and
+    stage() around each stage. When it isn't enabled nothing is recorded, so
+    the same code can run with and without profiling.
+    """
+    def __init__(self, enabled=True, cprofile=False):
+        self.enabled = enabled
+        self.stages = {}
+        self.wall = self.cpu = 0.0
+        self.peak_memory = 0
+        self.cprofile = cProfile.Profile() if enabled and cprofile else None
+
+        # Only stop tracing memory if the profiler started it
+        self.tracing = False
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+        tracemalloc.reset_peak()
+        if self.cprofile:
+            self.cprofile.enable()
+        self.start = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.enabled:
+            return False
+        wall, cpu = self.start
+        self.wall = time.perf_counter()-wall
+        self.cpu = time.process_time()-cpu
+        if self.cprofile:
+            self.cprofile.disable()
+        self.peak_memory = max(self.peak_memory,
+                               tracemalloc.get_traced_memory()[1])
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+        return False
+
+    def stage(self, name):
+        """Return a context manager recording the stage called name."""
+        return _Stage(self, name)
+
+    def timed(self, name, iterable):
+        """Generate the items of iterable, recording each step as a stage."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def report(self):
+        """Return the recorded times and memory as a dict."""
+        return {'wall': self.wall, 'cpu': self.cpu,
+                'peak_memory': self.peak_memory, 'stages': self.stages}
+
+    def stats(self):
+        """Return the cProfile stats (in the pstats format) or None."""
+        if not self.cprofile:
+            return None
+        self.cprofile.create_stats()
+        return self.cprofile.stats
+
+class _Stage:
+    """One run of a stage of a StageProfiler."""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            # Keep the peak of the treatment so far before measuring the peak
+            # of this stage from scratch
+            peak = tracemalloc.get_traced_memory()[1]
+            self.profiler.peak_memory = max(self.profiler.peak_memory, peak)
+            tracemalloc.reset_peak()
+            self.start = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.profiler.enabled:
+            return False
+        wall, cpu = self.start
+        stage = self.profiler.stages.setdefault(self.name, {
+            'wall': 0.0, 'cpu': 0.0, 'peak_memory': 0, 'calls': 0})
+        stage['wall'] += time.perf_counter()-wall
+        stage['cpu'] += time.process_time()-cpu
+        peak = tracemalloc.get_traced_memory()[1]
+        stage['peak_memory'] = max(stage['peak_memory'], peak)
+        self.profiler.peak_memory = max(self.profiler.peak_memory, peak)
+        stage['calls'] += 1
+        return False
+
+def write_report(path, profiles, cprofile=0):
+    """Write the profiles of an extraction run to a json report.
+
+    Parameters:
+        path - the file name of the report
+        profiles - a list of (treatment, profile, cProfile stats) for each
+                   treatment, where profile is a StageProfiler report
+        cprofile - how many of the slowest treatments to dump cProfile stats
+                   for, next to the report as "<treatment>.prof" (defaults to
+                   0)
+
+    Returns the file names of the cProfile dumps.
+    """
+    slowest = sorted(profiles, key=lambda p: p[1]['wall'], reverse=True)
+
+    # Sum the time spent in each stage over the whole run
+    stages = {}
+    for _, profile, _ in profiles:
+        for name, stage in profile['stages'].items():
+            total = stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0,
+                                             'peak_memory': 0, 'calls': 0})
+            total['wall'] += stage['wall']
+            total['cpu'] += stage['cpu']
+            total['peak_memory'] = max(total['peak_memory'],
+                                       stage['peak_memory'])
+            total['calls'] += stage['calls']
+
+    reports = [profile for _, profile, _ in profiles]
+    report = {
+        'total': {'wall': sum(p['wall'] for p in reports),
+                  'cpu': sum(p['cpu'] for p in reports),
+                  'peak_memory': max((p['peak_memory'] for p in reports),
+                                     default=0),
+                  'stages': stages},
+        'slowest': [treatment for treatment, _, _ in slowest],
+        'treatments': {treatment: p for treatment, p, _ in profiles},
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    dumps = []
+    for treatment, _, stats in slowest[:cprofile]:
+        if stats is None:
+            continue
+        dump = Path(path).parent/(Path(treatment).stem+'.prof')
+        with open(dump, 'wb') as f:
+            marshal.dump(stats, f)
+        dumps.append(dump)
+    return dumps
@@ -0,0 +1,291 @@
+import re
+import collections
+
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from . import backends
+from . import extract
+
+# --- Whole volumes ---
+#
+# A volume of Flora of North America has the treatments of many genera one
+# after another, each starting with a genus header (see extract.genus_pattern).
+# Subgroup headers repeat the name of their genus, so a header with a new name
+# starts the next treatment. Family headers look the same, but family names
+# end in "ACEAE" and the text up to the next genus isn't a genus treatment.
+#
+# The volume is read one page at a time and each genus treatment is parsed as
+# soon as the header of the next one has been read, so only a few treatments
+# are held in memory however long the volume is.
+#
+# pdftotext puts a form feed between pages, so the header at the top of a page
+# comes right after one instead of after a line break. Headers (and species
+# introductions) are found the way extract.genus_pattern finds them, except
+# that a form feed starts a line as well.
+header_pattern = re.compile(r'(?:^|(?<=\f))[ ]*\d+[a-z]*\.[ ]*([A-Z]+)\s+',
+                            flags=re.MULTILINE)
+
+# A genus whose header is missed anyway ends up in the text of the family
+# before it and would be skipped with it. Family text introduces genera rather
+# than species, so a species introduction ("n. Genus species") of a genus
+# whose name is in the family text in capitals is recorded as an error.
+species_intro_pattern = re.compile(r'(?:^|(?<=\f))\d+[a-z]*\.[ ]*'
+                                   r'([A-Z][a-z]+) (?:x\\)?[a-z\-]+',
+                                   flags=re.MULTILINE)
+
+def is_family(name):
+    """Return whether the name in a header is the name of a family."""
+    return name.endswith('ACEAE')
+
+def missed_intro(text):
+    """Return the first species introduction in family text or None."""
+    capitals = {}
+    for intro in species_intro_pattern.finditer(text):
+        genus = intro[1]
+        if genus not in capitals:
+            capitals[genus] = bool(re.search(r'\b'+genus.upper()+r'\b',
+                                             text))
+        if capitals[genus]:
+            return intro
+    return None
+
+def split_volume(pages):
+    """Generate the offset, name and text of each treatment in a volume.
+
+    Parameters:
+        pages - an iterator of the text of each page of the volume
+
+    The name is the one in the header the treatment starts with, and is a
+    family name for the text of a family. The offset is where the treatment
+    starts in the text of the whole volume. Each treatment is generated as
+    soon as the header of the next one has been read. The text before the
+    first header is skipped.
+    """
+    text = ''           # the text read since the last header with a new name
+    offset = 0          # the offset of text in the volume
+    name = ''           # the name in the header text starts with
+    searched = 0        # how much of text has been searched for headers
+
+    for page in pages:
+        text += page
+        while True:
+            header = header_pattern.search(text, searched)
+            if not header:
+                break
+            searched = header.end()
+            if header[1] == name:
+                continue
+
+            start = header.start()
+            if name:
+                yield offset, name, text[:start]
+            text = text[start:]
+            offset += start
+            searched -= start
+            name = header[1]
+
+        # The last line may be a header that continues on the next page
+        searched = max(searched, text.rfind('\n')+1, text.rfind('\f')+1)
+
+    if name:
+        yield offset, name, text
+
+def genus_results(text, budget=None, partitions=None, excerpt=200):
+    """Return the results of extract.results_from for a genus treatment.
+
+    Parameters:
+        text - the text of the genus treatment
+        budget - how many seconds parsing it may take (defaults to None)
+        partitions - the PartitionCache to reuse its partition from (defaults
+                     to None)
+        excerpt - how much of the text of each error to keep, as described by
+                  extract.extract_from (defaults to 200)
+
+    A treatment that can't be partitioned doesn't stop the rest of the volume
+    from being extracted: its error is recorded in the results instead.
+    """
+    try:
+        return extract.results_from(text, budget=budget,
+                                    partitions=partitions, excerpt=excerpt)
+    except ValueError as e:
+        genus = extract.genus_in(text) or 'a genus'
+        message = f"Couldn't extract {genus}: {str(e).splitlines()[-1]}"
+        # The record keeps every problem the partitioner found, not just the
+        # last one
+        record = extract.error_record('partition', f"Couldn't extract "
+                                      f"{genus}: {e}", text, 0, len(text),
+                                      excerpt=excerpt)
+        return {'locations': [], 'classifiers': [], 'records': [],
+                'error': [message], 'errors': [record], 'cache': '',
+                'timeout': False}
+
+def family_results(name, text, excerpt=200):
+    """Return results for the text of a family, which isn't extracted.
+
+    Parameters:
+        name - the family name in its header
+        text - the text of the family, up to the next genus header
+        excerpt - how much of the text of each error to keep, as described by
+                  extract.extract_from (defaults to 200)
+
+    The results have no records, and a "skipped" error if the text has a
+    species introduction in it (see missed_intro).
+    """
+    results = {'locations': [], 'classifiers': [], 'records': [],
+               'error': [], 'errors': [], 'cache': '', 'timeout': False}
+    intro = missed_intro(text)
+    if intro:
+        family = name[0]+name[1:].lower()
+        message = f"Skipped species of {intro[1]} in the text of {family}"
+        results['error'].append(message)
+        results['errors'].append(extract.error_record('skipped', message,
+                                                      text, intro.start(),
+                                                      len(text),
+                                                      excerpt=excerpt))
+    return results
+
+def treatment_results(name, text, budget=None, partitions=None, excerpt=200):
+    """Return the results of a treatment generated by split_volume.
+
+    Genera are parsed by genus_results and families by family_results, with
+    the same parameters.
+    """
+    if is_family(name):
+        return family_results(name, text, excerpt=excerpt)
+    return genus_results(text, budget=budget, partitions=partitions,
+                         excerpt=excerpt)
+
+def merge_results(genera):
+    """Combine the results of each genus of a volume, in order.
+
+    Parameters:
+        genera - an iterator of the offset of each genus treatment in the
+                 volume and its results
+
+    The offsets of the species records and error records are moved from the
+    treatment text to the text of the whole volume.
+    """
+    data = {'locations': [], 'classifiers': [], 'records': [],
+            'error': [], 'errors': [], 'cache': '', 'timeout': False}
+    for offset, results in genera:
+        data['records'].extend(record._replace(start=record.start+offset,
+                                               end=record.end+offset)
+                               for record in results['records'])
+        data['error'].extend(results['error'])
+        data['errors'].extend(dict(record, start=record['start']+offset,
+                                   end=record['end']+offset)
+                              for record in results['errors'])
+        data['timeout'] = data['timeout'] or results['timeout']
+
+    data['locations'] = list(extract.location_rows(data['records']))
+    data['classifiers'] = list(extract.classifier_rows(data['records']))
+    return data
+
+def map_ahead(executor, genera, budget=None, partitions=None, ahead=2,
+              excerpt=200):
+    """Generate the offset and results of each treatment, parsed by executor.
+
+    Parameters:
+        executor - the pool of worker processes to parse the genera with
+        genera - an iterator of the offset, name and text of each treatment,
+                 as generated by split_volume
+        budget - how many seconds parsing each genus may take (defaults to
+                 None)
+        partitions - the PartitionCache to reuse the partition of each genus
+                     from (defaults to None)
+        ahead - how many genera can be handed to the workers before the
+                results of the first are generated (defaults to 2)
+        excerpt - how much of the text of each error to keep (defaults to 200)
+
+    Genera are only read from the volume as the workers catch up, so the
+    text of at most `ahead` genera is held at once.
+    """
+    pending = collections.deque()
+    for offset, name, text in genera:
+        pending.append((offset, executor.submit(treatment_results, name,
+                                                text, budget, partitions,
+                                                excerpt)))
+        if len(pending) >= ahead:
+            offset, future = pending.popleft()
+            yield offset, future.result()
+
+    while pending:
+        offset, future = pending.popleft()
+        yield offset, future.result()
+
+def volume_results(volume, executor=None, ahead=2,
+                   backend=backends.default_backend, budget=None,
+                   partitions=None, excerpt=200, encoding='utf-8'):
+    """Return the results of extract.extract_from for a whole volume.
+
+    Parameters:
+        volume - the pdf file name of the volume
+        executor - the pool of worker processes to parse the genera with
+                   (defaults to None, meaning they're parsed in this process)
+        ahead - with an executor, how many genera can be handed to the
+                workers at a time, as described by map_ahead (defaults to 2)
+        backend - the name of the pdf text backend (defaults to
+                  backends.default_backend)
+        budget - how many seconds parsing each genus may take (defaults to
+                 None)
+        partitions - the PartitionCache to reuse the partition of each genus
+                     from (defaults to None)
+        excerpt - how much of the text of each error to keep (defaults to 200)
+        encoding - the encoding of the text (defaults to utf-8)
+
+    The text of the volume isn't cached, since it would have to be held in
+    memory all at once.
+    """
+    extractor = backends.get_backend(backend)
+    path = Path.joinpath(Path.cwd(), volume)
+    pages = extractor.pages(path, encoding=encoding)
+    try:
+        genera = split_volume(pages)
+        if executor:
+            parsed = map_ahead(executor, genera, budget=budget,
+                               partitions=partitions, ahead=ahead,
+                               excerpt=excerpt)
+        else:
+            parsed = ((offset, treatment_results(name, text, budget=budget,
+                                                 partitions=partitions,
+                                                 excerpt=excerpt))
+                      for offset, name, text in genera)
+        return merge_results(parsed)
+
+    # Stop extracting the rest of the pdf if something went wrong
+    finally:
+        if hasattr(pages, 'close'):
+            pages.close()
+
+def extract_volumes(volumes, jobs=1, backend=backends.default_backend,
+                    budget=None, partitions=None, excerpt=200):
+    """Generate the results of extract.extract_from for each volume.
+
+    Parameters:
+        volumes - a list of pdf file names of whole volumes
+        jobs - the number of worker processes to parse the genera of each
+               volume with (defaults to 1)
+        backend - the name of the pdf text backend (defaults to
+                  backends.default_backend)
+        budget - how many seconds parsing each genus may take (defaults to
+                 None)
+        partitions - the PartitionCache to reuse the partition of each genus
+                     from (defaults to None)
+        excerpt - how much of the text of each error to keep (defaults to 200)
+
+    Each volume is read in this process while its genera are parsed by the
+    workers, which are shared by all of the volumes.
+    """
+    if jobs == 1:
+        for volume in volumes:
+            yield volume_results(volume, backend=backend, budget=budget,
+                                 partitions=partitions, excerpt=excerpt)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=extract.warm_up) as executor:
+        for volume in volumes:
+            yield volume_results(volume, executor, ahead=2*jobs,
+                                 backend=backend, budget=budget,
+                                 partitions=partitions, excerpt=excerpt)
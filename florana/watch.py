@@ -0,0 +1,176 @@
+import os
+import time
+import signal
+import functools
+import collections
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from . import backends
+from . import extract
+
+# --- Watching a directory ---
+#
+# New and changed pdfs in the watched directory are extracted by a pool of
+# worker processes that's started once and kept for as long as florana runs,
+# so each worker only loads the gazetteer and location key once and keeps the
+# patterns it compiles. A pdf is only queued once its size and modification
+# time are the same on two polls in a row, so that files that are still being
+# copied in aren't extracted half written.
+
+def start_worker():
+    """Get a worker process ready to extract treatments.
+
+    Interrupting florana stops the main process, which then shuts the workers
+    down, so the workers themselves ignore the interrupt.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    extract.warm_up()
+
+def stop(signum, frame):
+    """Stop watching when florana is terminated, as if it were interrupted."""
+    raise KeyboardInterrupt
+
+def throughput(finished, started, now, window=60.0, minimum=0.0):
+    """Return how many treatments were extracted per minute lately.
+
+    Parameters:
+        finished - a deque of the time each treatment was extracted at, in
+                   order (times before the window are removed from it)
+        started - the time the first treatment was queued at
+        now - the current time
+        window - how many seconds back to count treatments for (defaults to
+                 60)
+        minimum - the fewest seconds to measure the rate over (defaults to
+                  0)
+
+    The rate is over the wall time of the window, or since the first
+    treatment was queued if that's more recent, so time spent looking for
+    pdfs and writing the output counts too. Pdfs are only found once per
+    poll, so the first few treatments would otherwise make a burst look
+    like a rate.
+    """
+    while finished and finished[0] <= now-window:
+        finished.popleft()
+    elapsed = max(now-max(started, now-window), minimum)
+    if elapsed <= 0:
+        return 0.0
+    return len(finished)/elapsed*60
+
+def watch(directory, sink, jobs=1, cache=None,
+          backend=backends.default_backend, stream=False, previous=None,
+          poll=2.0, budget=None, partitions=None, excerpt=200):
+    """Extract every new or changed pdf in directory until interrupted.
+
+    Parameters:
+        directory - the directory to watch, along with its subdirectories
+        sink - the OutputSink to write what's extracted from each treatment to
+        jobs - the number of worker processes to extract with (defaults to 1)
+        cache, backend, stream - passed on to extract_from
+        budget, partitions, excerpt - passed on to extract_from as well
+        previous - the Manifest of an earlier run, to skip the treatments it
+                   already extracted and to record the new ones in (defaults
+                   to None, meaning every pdf is extracted when watching
+                   starts)
+        poll - how often to look for new pdfs, in seconds (defaults to 2)
+
+    A line is printed for every treatment that's queued or extracted, with
+    the number of treatments in the queue and how many were extracted per
+    minute over the last minute.
+    """
+    extract_one = functools.partial(extract.extract_from, cache=cache,
+                                    backend=backend, stream=stream,
+                                    budget=budget, partitions=partitions,
+                                    excerpt=excerpt)
+    seen = {}           # the (size, mtime) of each pdf when it was queued
+    changed = {}        # the (size, mtime) of changed pdfs at the last poll
+    pending = {}        # the treatment and csv name of each queued future
+    extracted = 0
+    started = None      # when the first treatment was queued
+    finishes = collections.deque()  # when each recent treatment finished
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f'Watching {directory} with {jobs} worker(s), press Ctrl+C to stop')
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=start_worker) as executor:
+        try:
+            while True:
+                queued = {treatment for treatment, _ in pending.values()}
+                for treatment in extract.pdfs_in(directory, recursive=True):
+                    try:
+                        stat = os.stat(treatment)
+                    except FileNotFoundError:
+                        continue
+                    version = stat.st_size, stat.st_mtime_ns
+                    if seen.get(treatment) == version or treatment in queued:
+                        continue
+
+                    # Treatments extracted by an earlier run are only
+                    # extracted again once they change
+                    if previous and treatment not in seen and \
+                       previous.unchanged(treatment, backend):
+                        seen[treatment] = version
+                        continue
+
+                    # Wait until the pdf has stopped changing
+                    if changed.get(treatment) != version:
+                        changed[treatment] = version
+                        continue
+                    del changed[treatment]
+                    seen[treatment] = version
+
+                    fn = extract.csv_name(treatment)
+                    if not fn:
+                        print(f'"{treatment}" is not a pdf file!')
+                        continue
+                    future = executor.submit(extract_one, treatment)
+                    pending[future] = treatment, fn
+                    if started is None:
+                        started = time.monotonic()
+                    print(f'Queued {treatment} ({len(pending)} in the queue)')
+
+                # Write each treatment as soon as it's extracted, until it's
+                # time to poll again
+                deadline = time.monotonic()+poll
+                while True:
+                    remaining = deadline-time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if not pending:
+                        time.sleep(remaining)
+                        break
+
+                    finished, _ = wait(pending, timeout=remaining,
+                                       return_when=FIRST_COMPLETED)
+
+                    for future in finished:
+                        treatment, fn = pending.pop(future)
+                        try:
+                            results = future.result()
+                        except Exception as e:
+                            print(f"Couldn't extract {treatment}: {e}")
+                            continue
+
+                        sink.write(treatment, fn, results)
+                        if previous and not results['timeout']:
+                            previous.update(treatment, backend, results)
+                        extracted += 1
+                        now = time.monotonic()
+                        finishes.append(now)
+                        rate = throughput(finishes, started, now,
+                                          minimum=poll)
+                        print(f"Extracted {treatment}: "
+                              f"{len(results['records'])} species, "
+                              f"{len(results['error'])} without locations "
+                              f"({len(pending)} in the queue, "
+                              f"{rate:.1f} treatments/min)")
+
+                    if previous and finished:
+                        previous.save()
+
+        except KeyboardInterrupt:
+            print(f'Stopped watching {directory}: {extracted} treatments '
+                  f'extracted, {len(pending)} left in the queue')
+            for future in pending:
+                future.cancel()
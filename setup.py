@@ -1,11 +1,15 @@
+import re
 import setuptools
 
 with open('README.md', 'r') as fn:
     long_description = fn.read()
 
+with open('florana/__init__.py', 'r') as fn:
+    version = re.search(r"__version__ = '(.*)'", fn.read())[1]
+
 setuptools.setup(
     name='florana',
-    version='1.1.7',
+    version=version,
     description='Extract data from Flora of North America',
     long_description=long_description,
     long_description_content_type='text/markdown',
@@ -20,6 +24,6 @@ setuptools.setup(
         'Intended Audience :: Science/Research',
     ],
     packages=setuptools.find_packages(),
-    python_requires='>=3',
+    python_requires='>=3.9',
     package_data={'': ['*.txt', '*.json']},
 )
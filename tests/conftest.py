@@ -0,0 +1,56 @@
+import sys
+import shutil
+
+from pathlib import Path
+
+import pytest
+
+from florana import backends
+from florana import extract
+
+# The golden corpus: made up treatments, each written as the text pdftotext
+# would extract from its pdf, along with the csv files florana 1.1.7 wrote for
+# all of them (python -m florana.extract -A -o data.csv, in sorted order)
+corpus_dir = Path(__file__).parent/'corpus'
+corpus_names = sorted(path.stem for path in corpus_dir.glob('*.txt'))
+
+class PlainTextBackend(backends.Backend):
+    """A pdf backend for "pdfs" that are the text they stand for.
+
+    The tests run florana on text files named like pdfs, so they don't need
+    any pdf program installed.
+    """
+    name = 'text'
+
+    def text(self, path, encoding='utf-8'):
+        with open(path, encoding=encoding) as f:
+            return f.read()
+
+    def available(self):
+        return True
+
+def corpus_text(name):
+    """Return the text of the treatment called name in the golden corpus."""
+    with open(corpus_dir/f'{name}.txt', encoding='utf-8') as f:
+        return f.read()
+
+def copy_corpus(directory):
+    """Copy the golden corpus to directory as pdfs."""
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in corpus_names:
+        shutil.copy(corpus_dir/f'{name}.txt', directory/f'{name}.pdf')
+
+@pytest.fixture
+def florana(monkeypatch):
+    """Return a function that runs python -m florana.extract in a directory.
+
+    The runs read pdfs with PlainTextBackend and don't cache anything.
+    """
+    monkeypatch.setitem(backends.backends, 'text', PlainTextBackend())
+
+    def run(directory, *args):
+        monkeypatch.chdir(directory)
+        monkeypatch.setattr(sys, 'argv', ['florana.extract', *args,
+                                          '--backend', 'text', '--no-cache'])
+        extract.main()
+    return run
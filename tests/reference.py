@@ -0,0 +1,273 @@
+import re
+import json
+import itertools
+
+from pathlib import Path
+from collections import OrderedDict
+
+from florana import gazetteer
+
+# --- Reference parser ---
+#
+# The parsing functions of florana 1.1.7 as they were before extraction was
+# made faster, kept as they were so the tests can check that florana still
+# finds the same species, classifiers and locations. They slice the text
+# instead of searching it in place and search for locations with one long
+# alternation pattern, which is slow but simple enough to trust.
+#
+# One difference is expected: florana spells a location whose spaces are
+# missing from the text ("BritishColumbia") the way the gazetteer does, where
+# this passes it through as it is. The generated treatments never drop spaces.
+
+file_dir = Path(gazetteer.file_dir)
+
+genus_pattern = re.compile(r'^[ ]*\d+[a-z]*\.[ ]*([A-Z]+)\s+',
+                           flags=re.MULTILINE)
+
+def genus_in(treatment):
+    """Return the genus name in the given treatment string or ''."""
+    genus_match = genus_pattern.search(treatment)
+    if not genus_match:
+        return ""
+    genus = genus_match[1]
+    return genus[0]+(genus[1:].lower())
+
+def results(text):
+    """Return what florana 1.1.7 extracted from a treatment text.
+
+    Returns a dict of the "locations" and "classifiers" rows and the
+    "error" messages, in the format of extract.results_from. Raises a
+    ValueError if the treatment can't be partitioned.
+    """
+    genus = genus_in(text)
+    if not genus:
+        raise ValueError("No genus was found!")
+
+    data = {'locations': [], 'classifiers': [], 'error': []}
+    for block, name in partition(text, genus):
+        data['classifiers'].append((name, ids_in(block)))
+        locs = [(name, loc) for loc in locs_in(block)]
+        if not locs:
+            data['error'].append(f"Couldn't find locations for {name}")
+        data['locations'].extend(locs)
+    return data
+
+def partition(treatment, genus):
+    """Yield the block and name in treatment associated with each species."""
+    name_gens = [keys_in(subgroup, genus) for subgroup in subgroups(treatment)]
+    names = sorted(itertools.chain(*name_gens),
+                   key=lambda s: int(s.split('.')[0]))
+
+    names = (' '.join(name.split(' ')[1:3]).strip() for name in names)
+    names = OrderedDict.fromkeys(names).keys()
+
+    for block, name in species_blocks(treatment, names):
+        has_subspecies = False
+        for sub_block, sub_name in subspecies_blocks(block, name):
+            has_subspecies = True
+            yield sub_block, sub_name
+
+        if not has_subspecies:
+            yield block, name
+
+def subgroups(treatment):
+    """Generate each subgroup block in order."""
+    headers = list(genus_pattern.finditer(treatment))
+
+    i, j = 0, 0
+    if len(headers) > 1:
+        headers = headers[1:]
+
+    for next_header in headers:
+        j = next_header.start()
+        if i > 0:
+            yield treatment[i:j]
+        i = j
+
+    try:
+        k = treatment.lower().index("other reference")
+    except ValueError:
+        k = -1
+    if i > 0:
+        yield treatment[j:k]
+    else:
+        raise ValueError("No genus was found!")
+
+def keys_in(subgroup, genus):
+    """Generate all species names from the species key in a subgroup block."""
+    key_pattern = build_key_pattern(genus)
+
+    has_species_key = False
+    for match in key_pattern.finditer(subgroup):
+        has_species_key = True
+        yield match[0]
+
+    if not has_species_key:
+        intro_pattern = build_intro_pattern(genus)
+        intro = intro_pattern.search(subgroup)
+
+        if not intro:
+            raise ValueError('No species found!')
+        else:
+            yield '1. '+' '.join(intro.groups())
+
+def species_blocks(treatment, names):
+    """Generate all species blocks and names in treatment."""
+    error = ''
+    i, j = 0, 0
+
+    for next_name in names:
+        if len(next_name.split(' ')) > 2:
+            if error:
+                error += '\n'
+            error += f'"{next_name}" is too long: expected 2 words!'
+            continue
+        genus, species = next_name.split(' ')
+        intro_pattern = build_intro_pattern(genus, species=species)
+        intro = intro_pattern.search(treatment)
+
+        if not intro:
+            if error:
+                error += '\n'
+            error += f'Could not find species introduction for "{next_name}"'
+            continue
+
+        j = intro.start()
+
+        if i > j:
+            if error:
+                error += '\n'
+            error += f'When searching in {next_name}: Indices ({i}, {j}) are '\
+                     'out of order!'
+        elif i > 0:
+            yield treatment[i:j], name
+
+        name = next_name
+        i = j
+
+    try:
+        k = treatment.index("OTHER REFERENCES")
+    except ValueError:
+        k = -1
+    if i > 0:
+        yield treatment[j:k], name
+
+    if error:
+        error += "\nErrors occured while partitioning species blocks!"
+        raise ValueError(error)
+
+def subspecies_blocks(block, species):
+    """Generate all subspecies blocks in a species block, if any."""
+    if len(species.split(' ')) > 2:
+        raise ValueError(f'"{species}" is too long: expected 2 words!')
+    genus, species = species.split(' ')
+
+    intro_pattern = build_intro_pattern(genus, species=species,
+                                        subspecies=r'[a-z]+')
+
+    error = ''
+    i, j = 0, 0
+    name = ''
+    for intro in intro_pattern.finditer(block):
+        j = intro.start()
+        if i > 0:
+            if i > j:
+                if error:
+                    error += '\n'
+                error += f'When searching in "{name}" block: Indices '\
+                         f'({i}, {j}) are out of order!'
+            yield block[i:j], name
+
+        name = ' '.join(intro.groups())
+        i = j
+
+    if i > 0:
+        yield block[j:-1], name
+
+    if error:
+        error += "\nErrors occured when partitioning the treatment"
+        raise ValueError(error)
+
+def build_key_pattern(genus):
+    """Build a regex pattern for the genus key."""
+    return re.compile(r'(\d+)\.[ ]*('+genus+r' (?:x\\)?[a-z\-]+)'+
+                      r'(?: \(in part\))?\s*\n', flags=re.MULTILINE)
+
+def build_intro_pattern(genus, species=r'(?:x\\)?[a-z\-]+', subspecies=''):
+    """Build a regex pattern for a species introduction."""
+    pattern = r'^\d+'
+    if subspecies:
+        pattern += r'[a-z]+'
+
+    if 'x\\' in species and '[a-z' not in species:
+        species = species.replace('x\\', 'x\\\\')
+
+    pattern += r'\.[ ]*('+genus+') ('+species+')'
+    if subspecies:
+        pattern += r'.*?(?:subsp|var)\.\s*('+subspecies+')'
+
+    return re.compile(pattern, flags=re.MULTILINE|re.DOTALL)
+
+# --- Classifiers and locations ---
+
+id_pattern = re.compile(r'([CEFIW ]+)\s*$', re.MULTILINE)
+
+def ids_in(block):
+    """Return the classifiers of a species, or '' if it has none."""
+    for line in block.split('\n'):
+        matches = id_pattern.findall(line)
+        if matches:
+            return matches[-1].strip()
+    return ''
+
+loc_names = []
+for fn in gazetteer.gazetteer_files:
+    with open(file_dir/fn) as f:
+        s = f.read()
+        for r in ('.', '(', ')'):
+            s = s.replace(r, '\\'+r)
+        loc_names.extend('(?:'+m+')' for m in s.split('\n')[:-1])
+
+loc_names = sorted((loc.replace(' ', r'\s*') for loc in loc_names),
+                   key=len, reverse=True)
+
+loc_pattern = re.compile(r'[^;,]\s*('+'|'.join(loc_names)+
+                         r')(?:[;,]|\s*?$|\s*?\n)', re.MULTILINE)
+
+loc_text_pattern = re.compile(r'0[\)\]]?\s+?m;.*?(?<!Nfld|Labr|..St)'+
+                              r'\.\s*?(?:\n|$)', re.DOTALL|re.MULTILINE)
+loc_exception_pattern = re.compile(r'(?:Flowering.*?;|introduced;)'
+                                   r'.*?\.\s*?(?:\n|$)',
+                                   re.DOTALL|re.MULTILINE)
+
+with open(file_dir/'key.json') as f:
+    key = json.load(f)
+
+def loc_span(block):
+    """Return the span of the locations paragraph in a block or None."""
+    loc_match = loc_text_pattern.search(block)
+    if not loc_match:
+        loc_match = loc_exception_pattern.search(block)
+    return loc_match.span() if loc_match else None
+
+def locs_in(block):
+    """Generate the locations that a species appears in."""
+    span = loc_span(block)
+    loc_text = block[slice(*span)] if span else ''
+
+    locs = loc_pattern.findall(re.sub(r'[Bb]aja\s*[Cc]alifornia', '',
+                                      loc_text))
+    for loc in locs:
+        loc = ' '.join(loc.split())
+        if loc in key:
+            loc = key[loc]
+
+        if '(Labr.)' in loc:
+            yield 'Labr.'
+        elif '(Nfld.)' in loc:
+            yield 'Nfld.'
+        elif 'Nfld' in loc and 'Labr' in loc:
+            yield 'Nfld.'
+            yield 'Labr.'
+        elif loc:
+            yield loc
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from florana import bench
+from florana import extract
+
+import reference
+
+# Bits of text that the parser looks for or that break it up, which are
+# scattered over generated treatments and strung together into fragments
+tokens = ['C', 'E', 'F', 'I', 'W', ' ', '  ', '\n', '\r', '\t', 'a', 'x',
+          '.', ';', ',', '0', '0 m;', '0)', '0]', ' m;', 'm;', 'Nfld',
+          'Labr', 'Nfld.', 'Labr.', 'St.', 'x St', '.St', '\nSt', ',\nSt',
+          'Baja California', 'Calif.', 'Alta', 'Flowering ', 'introduced;',
+          'introduced', 'Other References', 'OTHER REFERENCES', '1. CAREX ',
+          '2a. CAREX sect. ', '3. Carex ab\n', ' F W\n', 'Wash.; Ont.',
+          '.\n']
+
+def noisy_treatment(rand):
+    """Return a generated treatment with tokens scattered over it."""
+    text = list(bench.synthetic_treatment(species=rand.randint(1, 20),
+                                          subspecies=rand.randint(0, 3),
+                                          subgroups=rand.randint(1, 3),
+                                          description=rand.randint(1, 3),
+                                          seed=rand.randrange(1 << 30)))
+    for _ in range(rand.randint(0, 30)):
+        text.insert(rand.randrange(len(text)+1), rand.choice(tokens))
+    return ''.join(text)
+
+def outcome(f, *args):
+    """Return what f returns, or the error it raises."""
+    try:
+        return f(*args)
+    except ValueError as e:
+        return repr(e)
+
+@pytest.mark.parametrize('seed', range(20))
+def test_treatments_match_reference(seed):
+    rand = random.Random(seed)
+    for _ in range(10):
+        text = noisy_treatment(rand)
+        expected = outcome(reference.results, text)
+        results = outcome(extract.results_from, text)
+        if isinstance(expected, str):
+            assert results == expected
+            continue
+        for part in ('locations', 'classifiers', 'error'):
+            assert results[part] == expected[part]
+
+@pytest.mark.parametrize('seed', range(20))
+def test_blocks_match_reference(seed):
+    rand = random.Random(seed)
+    text = noisy_treatment(rand)
+    for _ in range(200):
+        start = rand.randrange(len(text)+1)
+        end = rand.randrange(start, len(text)+1)
+        block = text[start:end]
+        ids = reference.ids_in(block)
+        locs = tuple(reference.locs_in(block))
+        assert extract.ids_in(text, start, end) == ids
+        assert tuple(extract.locs_in(text, start, end)) == locs
+        assert extract.analyze_block(text, start, end) == (ids, locs)
+
+@pytest.mark.parametrize('seed', range(10))
+def test_location_paragraphs_match_reference(seed):
+    rand = random.Random(seed)
+    for _ in range(2000):
+        block = ''.join(rand.choice(tokens)
+                        for _ in range(rand.randint(0, 14)))
+        start = rand.randint(0, len(block))
+        end = rand.randint(start, len(block))
+        span = reference.loc_span(block[start:end])
+        if span:
+            span = (span[0]+start, span[1]+start)
+        assert extract.loc_span(block, start, end) == span
@@ -0,0 +1,37 @@
+import pytest
+
+from florana import extract
+
+import reference
+from conftest import corpus_dir, corpus_names, corpus_text, copy_corpus
+
+@pytest.mark.parametrize('options', [[], ['--stream'],
+                                     ['--conversions', '2']])
+def test_csv_files_match_golden(tmp_path, florana, options):
+    copy_corpus(tmp_path)
+    florana(tmp_path, '-A', '-o', 'data.csv', *options)
+    for fn in ('data.csv', 'data-classifiers.csv'):
+        assert (tmp_path/fn).read_bytes() == (corpus_dir/fn).read_bytes()
+
+@pytest.mark.parametrize('name', corpus_names)
+def test_results_match_reference(name):
+    text = corpus_text(name)
+    expected = reference.results(text)
+    results = extract.results_from(text)
+    assert results['locations'] == expected['locations']
+    assert results['classifiers'] == expected['classifiers']
+    assert results['error'] == expected['error']
+    assert [error['species'] for error in results['errors']] == \
+           [record.name for record in results['records']
+            if not record.locations]
+
+@pytest.mark.parametrize('name', corpus_names)
+def test_records_span_their_blocks(name):
+    text = corpus_text(name)
+    genus = reference.genus_in(text)
+    blocks = list(reference.partition(text, genus))
+    records = list(extract.species_records(text))
+    assert [record.name for record in records] == \
+           [name for _, name in blocks]
+    assert [text[record.start:record.end] for record in records] == \
+           [block for block, _ in blocks]
@@ -0,0 +1,60 @@
+import json
+import shutil
+
+import pytest
+
+from florana import merge
+
+from conftest import copy_corpus
+
+outputs = ('data.csv', 'data-classifiers.csv', 'errors.jsonl')
+
+@pytest.fixture
+def corpus(tmp_path):
+    """Return a corpus with some of its treatments in subdirectories."""
+    directory = tmp_path/'corpus'
+    copy_corpus(directory)
+
+    # Aa/ sorts before the pdfs next to it and Zz/ after them
+    for name, subdirectory in (('small', 'Aa'), ('groups', 'Zz')):
+        (directory/subdirectory).mkdir()
+        shutil.move(directory/f'{name}.pdf', directory/subdirectory)
+    return directory
+
+def run_shards(florana, corpus, shards):
+    """Run each shard of corpus in a copy of it and return their indexes."""
+    indexes = []
+    for shard in range(1, shards+1):
+        node = corpus.parent/f'node-{shard}'
+        shutil.copytree(corpus, node)
+        florana(node, '-A', '-r', '-o', 'data.csv', '--shard',
+                f'{shard}/{shards}')
+        indexes.append(node/merge.index_name(shard, shards))
+    return indexes
+
+@pytest.mark.parametrize('shards', [1, 2, 3, 7])
+def test_merged_shards_match_single_run(tmp_path, florana, corpus, shards):
+    single = tmp_path/'single'
+    shutil.copytree(corpus, single)
+    florana(single, '-A', '-r', '-o', 'data.csv')
+
+    indexes = run_shards(florana, corpus, shards)
+    merged = tmp_path/'merged'
+    merged.mkdir()
+    assert merge.merge(indexes, fn=str(merged/'data.csv'),
+                       error_log=str(merged/'errors.jsonl')) == 7
+    for fn in outputs:
+        assert (merged/fn).read_bytes() == (single/fn).read_bytes()
+
+def test_merge_rejects_missing_shard(florana, corpus):
+    indexes = run_shards(florana, corpus, 3)
+    with pytest.raises(ValueError, match='Expected shards 1 to 3'):
+        merge.load_indexes(indexes[:2])
+
+def test_merge_rejects_different_treatments(florana, corpus):
+    indexes = run_shards(florana, corpus, 2)
+    index = json.loads(indexes[1].read_text())
+    index['names'].reverse()
+    indexes[1].write_text(json.dumps(index))
+    with pytest.raises(ValueError, match='same treatments'):
+        merge.load_indexes(indexes)